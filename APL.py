@@ -1,13 +1,20 @@
+import argparse
 from pFactor import getPFactorData
+from search import ONLINE, STALE_OK, CACHE_ONLY, CacheMiss
+from cache import format_age
 
 
-def APL():
+def APL(mode=ONLINE, top_k=None):
     user = input("AniList username: ")
 
     def progress(current, total, message):
         print(f"\r[{current}/{total}] {message}", end='', flush=True)
 
-    results = getPFactorData(user, progress_callback=progress)
+    try:
+        results = getPFactorData(user, progress_callback=progress, mode=mode, top_k=top_k)
+    except CacheMiss as e:
+        print(f"\n{e}. Run once without --offline to fetch it.")
+        return
     print()
 
     if not results:
@@ -19,8 +26,29 @@ def APL():
     for i, anime in enumerate(results, 1):
         rel = anime.get('relation') or ''
         title = anime['title'][:39]
-        print(f"{i:>3} {title:<40} {anime['APL']:>6} {anime['averageScore']:>5} {anime['episodes']:>4} {anime['watchTime']:>5}h {rel}")
+        mark = '*' if anime.get('stale') else ' '
+        print(f"{i:>3}{mark}{title:<40} {anime['APL']:>6} {anime['averageScore']:>5} {anime['episodes']:>4} {anime['watchTime']:>5}h {rel}")
+
+    stale = [a for a in results if a.get('stale')]
+    if stale:
+        ages = [a['dataAge'] for a in stale if a['dataAge'] is not None]
+        oldest = format_age(max(ages)) if ages else "missing"
+        print(f"\n* {len(stale)} titles from expired or missing cache data (oldest: {oldest})")
+
+    unresolved = sum(1 for a in results if a.get('unresolved'))
+    if unresolved:
+        print(f"{unresolved} titles could not be fetched and were scored without relations. "
+              f"Run again to resume.")
 
 
 if __name__ == '__main__':
-    APL()
+    parser = argparse.ArgumentParser(description="Anime Priority List")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--offline', action='store_const', dest='mode', const=CACHE_ONLY,
+                       help="use cached data only, never contact AniList")
+    group.add_argument('--stale', action='store_const', dest='mode', const=STALE_OK,
+                       help="use expired cache entries instead of refetching them")
+    parser.add_argument('--top', type=int, metavar='K', dest='top_k',
+                        help="only rank the K highest-APL titles (fetches fewer relations)")
+    args = parser.parse_args()
+    APL(mode=args.mode or ONLINE, top_k=args.top_k)
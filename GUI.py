@@ -1,19 +1,31 @@
 import sys
 import json
 import os
+import time
 import webbrowser
 from PyQt5 import QtGui
-from PyQt5.QtCore import Qt, QRunnable, QObject, pyqtSignal, pyqtSlot, QThreadPool
+from PyQt5.QtCore import (
+    Qt, QRunnable, QObject, pyqtSignal, pyqtSlot, QThreadPool,
+    QAbstractTableModel, QModelIndex
+)
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QLabel, QLineEdit, QPushButton, QTableWidget, QTableWidgetItem,
+    QLabel, QLineEdit, QPushButton, QTableView, QCheckBox,
+    QSpinBox,
     QProgressBar, QStatusBar, QMessageBox, QHeaderView, QAbstractItemView,
-    QStyledItemDelegate, QStyle
+    QStyle
 )
-from PyQt5.QtGui import QFont, QCursor, QColor, QPen, QPainter
+from PyQt5.QtGui import QFont, QCursor, QColor, QPen, QPainter, QBrush
 from pFactor import getPFactorData
+from scheduler import RefreshScheduler
+from search import ONLINE, STALE_OK
+from cache import format_age
+from filters import ResultIndex, parseQuery
+from history import history, formatDelta
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_INDEX_ROLE = Qt.UserRole + 1   # position in MainWindow.data
+GROUP_ROLE = Qt.UserRole + 2        # franchise group index, None for ungrouped rows
 
 
 class WorkerSignals(QObject):
@@ -23,15 +35,20 @@ class WorkerSignals(QObject):
 
 
 class Worker(QRunnable):
-    def __init__(self, username):
+    def __init__(self, username, mode=ONLINE, revalidate=None, top_k=None):
         super().__init__()
         self.username = username
+        self.mode = mode
+        self.revalidate = revalidate
+        self.top_k = top_k
         self.signals = WorkerSignals()
 
     @pyqtSlot()
     def run(self):
         try:
-            data = getPFactorData(self.username, progress_callback=self._progress)
+            data = getPFactorData(self.username, progress_callback=self._progress,
+                                  mode=self.mode, revalidate=self.revalidate,
+                                  top_k=self.top_k)
             self.signals.result.emit(data)
         except Exception as e:
             self.signals.error.emit(str(e))
@@ -40,19 +57,16 @@ class Worker(QRunnable):
         self.signals.progress.emit(current, total, message)
 
 
-class NumericTableItem(QTableWidgetItem):
-    """Table item that sorts numerically instead of alphabetically."""
-    def __lt__(self, other):
-        try:
-            return float(self.text()) < float(other.text())
-        except ValueError:
-            return super().__lt__(other)
-
+class GroupTable(QTableView):
+    """
+    Results table that outlines franchise groups after painting its cells.
 
-class GroupBorderDelegate(QStyledItemDelegate):
-    """Draws group outline borders on grouped rows."""
+    Group membership is read from GROUP_ROLE on each row, so it follows rows
+    through sorting and filtering. Each run of adjacent rows in the same
+    group gets one outline rectangle, with a pen cached per accent color.
+    """
 
-    # Accent colors for group left-edge bars
+    # Accent colors for group outlines
     GROUP_ACCENTS = [
         QColor('#7c4dff'),  # purple
         QColor('#448aff'),  # blue
@@ -64,68 +78,64 @@ class GroupBorderDelegate(QStyledItemDelegate):
 
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.group_map = {}  # row -> (group_idx, group_size, is_first, is_last)
-
-    def set_group_map(self, data):
-        """Build row -> group info mapping from result data."""
-        self.group_map.clear()
-        prev_group = None
-        group_start = 0
-        for row, anime in enumerate(data):
-            group = anime.get('group', -1)
-            group_size = anime.get('groupSize', 1)
-            if group_size <= 1:
-                prev_group = None
-                continue
-            is_first = (group != prev_group)
-            # Look ahead to check if this is the last in the group
-            is_last = (row + 1 >= len(data) or
-                       data[row + 1].get('group', -1) != group or
-                       data[row + 1].get('groupSize', 1) <= 1)
-            self.group_map[row] = (group, group_size, is_first, is_last)
-            prev_group = group
-
-    def paint(self, painter, option, index):
-        super().paint(painter, option, index)
-        row = index.row()
-        if row not in self.group_map:
+        self.pens = []
+        for accent in self.GROUP_ACCENTS:
+            color = QColor(accent)
+            color.setAlpha(160)
+            self.pens.append(QPen(color, 2))
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        painter = QPainter(self.viewport())
+        self._paint_groups(painter)
+        painter.end()
+
+    def _group(self, row):
+        model = self.model()
+        if not 0 <= row < model.rowCount():
+            return None
+        return model.index(row, 1).data(GROUP_ROLE)
+
+    def _paint_groups(self, painter):
+        model = self.model()
+        first = self.rowAt(0)
+        if first < 0:
             return
-
-        group_idx, group_size, is_first, is_last = self.group_map[row]
-        accent = self.GROUP_ACCENTS[group_idx % len(self.GROUP_ACCENTS)]
-        border_color = QColor(accent)
-        border_color.setAlpha(160)
+        last = self.rowAt(self.viewport().height() - 1)
+        if last < 0:
+            last = model.rowCount() - 1
+        last_col = model.columnCount() - 1
+        left = self.columnViewportPosition(0)
+        right = self.columnViewportPosition(last_col) + self.columnWidth(last_col)
+
+        # Collect (group, first row, last row) spans over the visible rows
+        spans = []
+        for row in range(first, last + 1):
+            group = self._group(row)
+            if group is not None and spans and spans[-1][0] == group:
+                spans[-1][2] = row
+            else:
+                spans.append([group, row, row])
 
         painter.save()
-        pen = QPen(border_color, 2)
-        painter.setPen(pen)
-        rect = option.rect
-
-        col = index.column()
-        col_count = index.model().columnCount() if index.model() else 10
-        is_first_col = (col == 0)
-        is_last_col = (col == col_count - 1)
-
-        # Top border (first row of group)
-        if is_first:
-            painter.drawLine(rect.left(), rect.top() + 1, rect.right(), rect.top() + 1)
-
-        # Bottom border (last row of group)
-        if is_last:
-            painter.drawLine(rect.left(), rect.bottom(), rect.right(), rect.bottom())
-
-        # Left border (first column only)
-        if is_first_col:
-            painter.drawLine(rect.left() + 1, rect.top(), rect.left() + 1, rect.bottom())
-
-        # Right border (last column only)
-        if is_last_col:
-            painter.drawLine(rect.right(), rect.top(), rect.right(), rect.bottom())
-
+        painter.setBrush(Qt.NoBrush)
+        for group, start, end in spans:
+            if group is None:
+                continue
+            top = self.rowViewportPosition(start)
+            bottom = self.rowViewportPosition(end) + self.rowHeight(end)
+            # A span cut off by the viewport edge must not get an outline there
+            if start == first and self._group(start - 1) == group:
+                top -= 4
+            if end == last and self._group(end + 1) == group:
+                bottom += 4
+            painter.setPen(self.pens[group % len(self.pens)])
+            painter.drawRect(left + 1, top + 1, right - left - 2, bottom - top - 2)
         painter.restore()
 
 
-COLUMNS = ['#', 'Title', 'APL', 'Score', 'Eps', 'Min/Ep', 'Hours', 'P-Factor', 'B-Factor', 'Relation']
+COLUMNS = ['#', 'Title', 'APL', 'Score', 'Eps', 'Min/Ep', 'Hours', 'P-Factor', 'B-Factor',
+           'G-Factor', 'Pop', 'Relation']
 USERDATA_PATH = os.path.join(BASE_DIR, 'userdata.json')
 
 # Group background tints (applied to grouped rows)
@@ -137,6 +147,179 @@ GROUP_BG = [
     QColor(55, 30, 32),   # red tint
     QColor(32, 50, 35),   # green tint
 ]
+GROUP_BRUSHES = [QBrush(color) for color in GROUP_BG]
+
+# Result key shown in each column ('#' is the position in the results)
+COLUMN_KEYS = [None, 'title', 'APL', 'averageScore', 'episodes', 'duration', 'watchTime',
+               'pfactor', 'bfactor', 'gfactor', 'popfactor', 'relation']
+TEXT_COLUMNS = {1, 11}
+BLANK_ZERO_COLUMNS = {6, 7, 8, 9, 10}   # factors and hours show empty instead of 0
+FIT_SAMPLE_ROWS = 1000   # rows measured when sizing columns to their contents
+CELL_PADDING = 16        # item padding and margins around the cell text
+SEQUEL_COLOR = QColor('#66bb6a')
+APL_COLOR = QColor('#ce93d8')
+ALIGN_CENTER = int(Qt.AlignCenter)
+MODEL_ROLES = {Qt.DisplayRole, Qt.TextAlignmentRole, Qt.BackgroundRole, Qt.ForegroundRole,
+               Qt.ToolTipRole, Qt.UserRole, DATA_INDEX_ROLE, GROUP_ROLE}
+
+
+class ResultsModel(QAbstractTableModel):
+    """
+    getPFactorData rows as a read-only, sortable and filterable table model.
+
+    order lists every data position in sorted order and visible the ones that
+    pass the filter; table rows index into visible. Sorting is a Python sort
+    of ints by precomputed keys and filtering one pass over order against a
+    ResultIndex match set, and cells are only produced for the rows the view
+    asks about.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+        self.order = []
+        self.visible = []
+        self.matched = None      # ResultIndex.query() result, None shows every row
+        self.group_sort = False
+        self._sort_spec = None   # (column, order) of the last sort, reapplied on reload
+
+    def set_rows(self, rows):
+        """Show new results, unfiltered and sorted like the previous ones."""
+        self.beginResetModel()
+        self.rows = rows
+        self.matched = None
+        self.order = list(range(len(rows)))
+        if self._sort_spec:
+            self.order = self._sorted(*self._sort_spec)
+        self.visible = self.order
+        self.endResetModel()
+
+    def set_matched(self, matched):
+        """Show only the data positions in matched (all rows if None)."""
+        if matched == self.matched:
+            return
+        self.matched = matched
+        self._relayout()
+
+    def _relayout(self):
+        """Rebuild visible from order and matched, keeping selection on the same titles."""
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        positions = [self.visible[index.row()] for index in persistent]
+        matched = self.matched
+        self.visible = self.order if matched is None else [pos for pos in self.order if pos in matched]
+        if persistent:
+            row_of = {pos: row for row, pos in enumerate(self.visible)}
+            self.changePersistentIndexList(persistent, [
+                self.index(row_of[pos], index.column()) if pos in row_of else QModelIndex()
+                for pos, index in zip(positions, persistent)
+            ])
+        self.layoutChanged.emit()
+
+    def index(self, row, column, parent=QModelIndex()):
+        # The default checks rowCount() and columnCount() first, two more
+        # Python calls for every cell the view looks up
+        if parent.isValid() or not (0 <= row < len(self.visible) and 0 <= column < len(COLUMNS)):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.visible)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role not in MODEL_ROLES:
+            return None   # the delegate asks for several roles per cell it paints
+        pos = self.visible[index.row()]
+        col = index.column()
+        if role == Qt.DisplayRole:
+            return self.text(pos, col)
+        if role == Qt.TextAlignmentRole:
+            return None if col in TEXT_COLUMNS else ALIGN_CENTER
+        anime = self.rows[pos]
+        if role == Qt.BackgroundRole:
+            if anime.get('groupSize', 1) > 1:
+                return GROUP_BRUSHES[anime.get('group', 0) % len(GROUP_BRUSHES)]
+            return None   # use default alternating colors
+        if role == Qt.ForegroundRole:
+            if col == 2:
+                return APL_COLOR
+            if (col == 7 and anime['pfactor'] > 0) or (col == 11 and anime.get('relation')):
+                return SEQUEL_COLOR
+            return None
+        if role == Qt.ToolTipRole:
+            if col == 1 and 'dataAge' in anime:
+                stale_note = " (expired)" if anime.get('stale') else ""
+                if anime.get('unresolved'):
+                    stale_note = " (relations unavailable, scored without P-Factor)"
+                return f"Data age: {format_age(anime['dataAge'])}{stale_note}"
+            if col == 9 and anime.get('genres'):
+                return ", ".join(anime['genres'])
+            return None
+        if role == Qt.UserRole:
+            return anime['id']
+        if role == DATA_INDEX_ROLE:
+            return pos
+        if role == GROUP_ROLE:
+            return anime.get('group', 0) if anime.get('groupSize', 1) > 1 else None
+        return None
+
+    def text(self, pos, col):
+        """Cell text of column col for the row at data position pos."""
+        if col == 0:
+            return str(pos + 1)
+        value = self.rows[pos].get(COLUMN_KEYS[col])
+        if col in BLANK_ZERO_COLUMNS and not value:
+            return ""
+        return str(value) if value is not None else ""
+
+    def _sort_values(self, column):
+        """Data position -> value column sorts by."""
+        if column == 0:
+            return list(range(len(self.rows)))
+        key = COLUMN_KEYS[column]
+        if column in TEXT_COLUMNS:
+            return [a.get(key) or "" for a in self.rows]
+        return [a.get(key) or 0 for a in self.rows]
+
+    def _sorted(self, column, order):
+        values = self._sort_values(column)
+        descending = order == Qt.DescendingOrder
+        if not self.group_sort:
+            return sorted(self.order, key=values.__getitem__, reverse=descending)
+
+        # Keep each franchise group contiguous: groups are ordered by their best
+        # value in the sort direction (ungrouped titles are groups of one) and
+        # members keep their franchise order
+        if column in TEXT_COLUMNS:
+            values = [v.lower() for v in values]
+        group_of = [a['group'] if a.get('groupSize', 1) > 1 else -1 - pos
+                    for pos, a in enumerate(self.rows)]
+        best = {}
+        pick = max if descending else min
+        for pos, group in enumerate(group_of):
+            best[group] = pick(best[group], values[pos]) if group in best else values[pos]
+        # The sort is reversed for descending order, so negate the in-group
+        # position to keep franchise order in both directions
+        sign = -1 if descending else 1
+        return sorted(self.order, key=lambda pos: (best[group_of[pos]], group_of[pos], sign * pos),
+                      reverse=descending)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if not 0 <= column < len(COLUMNS):
+            return   # no sort column chosen yet
+        self._sort_spec = (column, order)
+        if self.rows:
+            self.order = self._sorted(column, order)
+            self._relayout()
+
 
 STYLESHEET = """
     QMainWindow {
@@ -148,6 +331,16 @@ STYLESHEET = """
     QLabel {
         color: #e0e0e0;
     }
+    QCheckBox {
+        color: #e0e0e0;
+    }
+    QSpinBox {
+        background-color: #16213e;
+        color: #e0e0e0;
+        border: 1px solid #0f3460;
+        padding: 4px;
+        border-radius: 4px;
+    }
     QLineEdit {
         background-color: #16213e;
         color: #e0e0e0;
@@ -183,7 +376,7 @@ STYLESHEET = """
     QPushButton#clearCache:hover {
         background-color: #154785;
     }
-    QTableWidget {
+    QTableView {
         background-color: #16213e;
         alternate-background-color: #1a2744;
         color: #e0e0e0;
@@ -193,7 +386,7 @@ STYLESHEET = """
         selection-background-color: #533483;
         selection-color: #ffffff;
     }
-    QTableWidget::item {
+    QTableView::item {
         padding: 4px;
     }
     QHeaderView::section {
@@ -252,9 +445,12 @@ class MainWindow(QMainWindow):
         super().__init__()
         self.threadpool = QThreadPool()
         self.data = []
-        self.group_delegate = GroupBorderDelegate()
+        self.scheduler = RefreshScheduler()
+        self.index = None
+        self.model = ResultsModel()
         self._init_ui()
         self._load_userdata()
+        self.scheduler.start()
 
     def _init_ui(self):
         self.setWindowTitle("Anime Priority List v3")
@@ -302,6 +498,34 @@ class MainWindow(QMainWindow):
         self.btn_clear_cache.clicked.connect(self.clear_cache)
         top_bar.addWidget(self.btn_clear_cache)
 
+        self.btn_changes = QPushButton("Changes")
+        self.btn_changes.setObjectName("clearCache")
+        self.btn_changes.setFont(QFont('Segoe UI', 9))
+        self.btn_changes.setFixedSize(95, 32)
+        self.btn_changes.setToolTip("What changed in your lists and APL ranking the last time anything changed")
+        self.btn_changes.clicked.connect(self.show_changes)
+        top_bar.addWidget(self.btn_changes)
+
+        self.chk_stale = QCheckBox("Use stale cache")
+        self.chk_stale.setFont(QFont('Segoe UI', 9))
+        self.chk_stale.setChecked(True)
+        self.chk_stale.setToolTip(
+            "Show expired cached data immediately and refresh it in the background"
+        )
+        top_bar.addWidget(self.chk_stale)
+
+        lbl_top = QLabel("Top:")
+        lbl_top.setFont(QFont('Segoe UI', 9))
+        top_bar.addWidget(lbl_top)
+
+        self.spin_top = QSpinBox()
+        self.spin_top.setFont(QFont('Segoe UI', 9))
+        self.spin_top.setRange(0, 1000)
+        self.spin_top.setSpecialValueText("All")
+        self.spin_top.setToolTip("Only rank the N highest-APL titles (fewer API calls)")
+        self.spin_top.setFixedWidth(70)
+        top_bar.addWidget(self.spin_top)
+
         top_bar.addStretch()
         layout.addLayout(top_bar)
 
@@ -312,26 +536,55 @@ class MainWindow(QMainWindow):
         self.progress_bar.setTextVisible(True)
         layout.addWidget(self.progress_bar)
 
+        # --- Filter bar ---
+        filter_bar = QHBoxLayout()
+
+        self.filter_input = QLineEdit()
+        self.filter_input.setFont(QFont('Segoe UI', 9))
+        self.filter_input.setPlaceholderText(
+            "Filter: title text, ^prefix, apl>85 score>=80 eps<=13 hours<10 pf>0 sequels"
+        )
+        self.filter_input.setClearButtonEnabled(True)
+        self.filter_input.textChanged.connect(self.apply_filter)
+        filter_bar.addWidget(self.filter_input)
+
+        self.chk_keep_groups = QCheckBox("Keep franchise groups")
+        self.chk_keep_groups.setFont(QFont('Segoe UI', 9))
+        self.chk_keep_groups.setChecked(True)
+        self.chk_keep_groups.setToolTip("Show the whole franchise group when any of its titles match")
+        self.chk_keep_groups.toggled.connect(self.apply_filter)
+        filter_bar.addWidget(self.chk_keep_groups)
+
+        self.chk_group_sort = QCheckBox("Sort by group")
+        self.chk_group_sort.setFont(QFont('Segoe UI', 9))
+        self.chk_group_sort.setToolTip(
+            "Keep franchise groups together when sorting, ordered by their best title"
+        )
+        self.chk_group_sort.toggled.connect(self._set_group_sort)
+        filter_bar.addWidget(self.chk_group_sort)
+
+        layout.addLayout(filter_bar)
+
         # --- Table ---
-        self.table = QTableWidget()
-        self.table.setColumnCount(len(COLUMNS))
-        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table = GroupTable()
+        self.table.setModel(self.model)
         self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.table.setAlternatingRowColors(True)
+        # Start unsorted (in APL/franchise order) until a header is clicked
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
         self.table.setSortingEnabled(True)
         self.table.verticalHeader().setVisible(False)
         self.table.setFont(QFont('Segoe UI', 9))
         self.table.setShowGrid(True)
-        self.table.setItemDelegate(self.group_delegate)
 
         header = self.table.horizontalHeader()
         header.setFont(QFont('Segoe UI', 9, QFont.Bold))
         header.setSectionResizeMode(0, QHeaderView.Fixed)        # #
         header.setSectionResizeMode(1, QHeaderView.Stretch)      # Title
-        header.setSectionResizeMode(9, QHeaderView.Stretch)      # Relation
-        for col in range(2, 9):
-            header.setSectionResizeMode(col, QHeaderView.ResizeToContents)
+        header.setSectionResizeMode(11, QHeaderView.Stretch)     # Relation
+        for col in range(2, 11):
+            header.setSectionResizeMode(col, QHeaderView.Interactive)   # sized by _fit_columns
 
         self.table.setColumnWidth(0, 40)
         self.table.doubleClicked.connect(self.open_anilist)
@@ -352,12 +605,14 @@ class MainWindow(QMainWindow):
                 with open(USERDATA_PATH, 'r') as f:
                     data = json.load(f)
                 self.username_input.setText(data.get('Anilist', ''))
+                self.scheduler.track_user(data.get('Anilist', ''))
             except (json.JSONDecodeError, IOError):
                 pass
 
     def save_userdata(self):
         with open(USERDATA_PATH, 'w') as f:
             json.dump({'Anilist': self.username_input.text()}, f)
+        self.scheduler.track_user(self.username_input.text().strip())
         self.status_label.setText("User data saved.")
 
     def clear_cache(self):
@@ -365,6 +620,17 @@ class MainWindow(QMainWindow):
         cache.clear()
         self.status_label.setText("Cache cleared.")
 
+    def show_changes(self):
+        username = self.username_input.text().strip()
+        last = history.last_change(username) if username else None
+        if last is None:
+            QMessageBox.information(self, "APL", "No history recorded yet - click Generate first.")
+            return
+        ts, delta = last
+        text = '\n'.join(formatDelta(delta, history.titles(username)))
+        when = format_age(time.time() - ts)
+        QMessageBox.information(self, "APL - Changes", f"Last change ({when} ago):\n\n{text}")
+
     def generate(self):
         username = self.username_input.text().strip()
         if not username:
@@ -376,8 +642,11 @@ class MainWindow(QMainWindow):
         self.progress_bar.setVisible(True)
         self.progress_bar.setValue(0)
         self.status_label.setText("Fetching data...")
+        self.scheduler.track_user(username)
 
-        worker = Worker(username)
+        mode = STALE_OK if self.chk_stale.isChecked() else ONLINE
+        worker = Worker(username, mode, self.scheduler.revalidate,
+                        top_k=self.spin_top.value() or None)
         worker.signals.progress.connect(self.on_progress)
         worker.signals.result.connect(self.on_result)
         worker.signals.error.connect(self.on_error)
@@ -390,7 +659,7 @@ class MainWindow(QMainWindow):
 
     def on_result(self, data):
         self.data = data
-        self.group_delegate.set_group_map(data)
+        self.index = ResultIndex(data)
         self._populate_table(data)
         self.btn_generate.setEnabled(True)
         self.setCursor(QCursor(Qt.ArrowCursor))
@@ -399,8 +668,15 @@ class MainWindow(QMainWindow):
         total_hours = sum(a['watchTime'] for a in data)
         groups = len({a['group'] for a in data if a.get('groupSize', 1) > 1})
         group_text = f" | {groups} franchise groups" if groups else ""
-        self.status_label.setText(f"{len(data)} anime loaded{group_text}")
-        self.stats_label.setText(f"Total watch time: {total_hours:,.1f} hours")
+        stale = [a for a in data if a.get('stale')]
+        stale_text = f" | {len(stale)} from stale cache, refreshing" if stale else ""
+        unresolved = sum(1 for a in data if a.get('unresolved'))
+        if unresolved:
+            stale_text += f" | {unresolved} unresolved - Generate again to resume"
+        self.status_label.setText(f"{len(data)} anime loaded{group_text}{stale_text}")
+        self._total_text = f"Total watch time: {total_hours:,.1f} hours"
+        self.stats_label.setText(self._total_text)
+        self.apply_filter()
 
     def on_error(self, error_msg):
         self.btn_generate.setEnabled(True)
@@ -412,110 +688,51 @@ class MainWindow(QMainWindow):
         )
 
     def _populate_table(self, data):
-        self.table.setSortingEnabled(False)
-        self.table.setRowCount(len(data))
-
-        sequel_color = QColor('#66bb6a')
-        apl_color = QColor('#ce93d8')
+        self.model.set_rows(data)
+        self._fit_columns()
+
+    def _fit_columns(self):
+        """
+        Size the numeric columns to their widest text once per load. With
+        ResizeToContents the header re-measures cells through the model after
+        every sort and filter keystroke.
+        """
+        rows = len(self.model.rows)
+        sample = range(0, rows, max(1, rows // FIT_SAMPLE_ROWS))   # ResizeToContents also samples ~1000
+        header = self.table.horizontalHeader()
+        digit = self.table.fontMetrics().horizontalAdvance('0')
+        for col in range(2, 11):
+            chars = max((len(self.model.text(pos, col)) for pos in sample), default=0)
+            self.table.setColumnWidth(col, max(header.sectionSizeHint(col), chars * digit + CELL_PADDING))
+
+    def _set_group_sort(self, enabled):
+        """Switch between plain column sorting and group-contiguous sorting."""
+        self.model.group_sort = enabled
+        header = self.table.horizontalHeader()
+        self.table.sortByColumn(header.sortIndicatorSection(), header.sortIndicatorOrder())
 
-        for row, anime in enumerate(data):
-            group_size = anime.get('groupSize', 1)
-            group_idx = anime.get('group', 0)
+    def apply_filter(self, *args):
+        """Show only the rows matching the filter bar."""
+        if self.index is None:
+            return
+        query = parseQuery(self.filter_input.text())
+        matched = self.index.query(query, keep_groups=self.chk_keep_groups.isChecked())
+        self.model.set_matched(matched)
 
-            # Determine background color
-            if group_size > 1:
-                bg = GROUP_BG[group_idx % len(GROUP_BG)]
-            else:
-                bg = None  # use default alternating colors
-
-            # #
-            item = NumericTableItem(str(row + 1))
-            item.setTextAlignment(Qt.AlignCenter)
-            if bg:
-                item.setBackground(bg)
-            self.table.setItem(row, 0, item)
-
-            # Title
-            item = QTableWidgetItem(anime['title'])
-            item.setData(Qt.UserRole, anime['id'])
-            if bg:
-                item.setBackground(bg)
-            self.table.setItem(row, 1, item)
-
-            # APL
-            item = NumericTableItem(str(anime['APL']))
-            item.setTextAlignment(Qt.AlignCenter)
-            item.setForeground(apl_color)
-            if bg:
-                item.setBackground(bg)
-            self.table.setItem(row, 2, item)
-
-            # Score
-            item = NumericTableItem(str(anime['averageScore']))
-            item.setTextAlignment(Qt.AlignCenter)
-            if bg:
-                item.setBackground(bg)
-            self.table.setItem(row, 3, item)
-
-            # Episodes
-            item = NumericTableItem(str(anime['episodes']))
-            item.setTextAlignment(Qt.AlignCenter)
-            if bg:
-                item.setBackground(bg)
-            self.table.setItem(row, 4, item)
-
-            # Duration
-            item = NumericTableItem(str(anime['duration']))
-            item.setTextAlignment(Qt.AlignCenter)
-            if bg:
-                item.setBackground(bg)
-            self.table.setItem(row, 5, item)
-
-            # Watch Time (hours)
-            wt = anime['watchTime']
-            item = NumericTableItem(str(wt) if wt > 0 else "")
-            item.setTextAlignment(Qt.AlignCenter)
-            if bg:
-                item.setBackground(bg)
-            self.table.setItem(row, 6, item)
-
-            # P-Factor
-            pf = anime['pfactor']
-            item = NumericTableItem(str(pf) if pf > 0 else "")
-            item.setTextAlignment(Qt.AlignCenter)
-            if pf > 0:
-                item.setForeground(sequel_color)
-            if bg:
-                item.setBackground(bg)
-            self.table.setItem(row, 7, item)
-
-            # B-Factor
-            bf = anime['bfactor']
-            item = NumericTableItem(str(bf) if bf > 0 else "")
-            item.setTextAlignment(Qt.AlignCenter)
-            if bg:
-                item.setBackground(bg)
-            self.table.setItem(row, 8, item)
-
-            # Relation
-            rel_text = anime.get('relation') or ""
-            item = QTableWidgetItem(rel_text)
-            if rel_text:
-                item.setForeground(sequel_color)
-            if bg:
-                item.setBackground(bg)
-            self.table.setItem(row, 9, item)
+        if matched is None:
+            self.stats_label.setText(self._total_text)
+        else:
+            self.stats_label.setText(f"Showing {len(matched)} of {self.index.size}")
 
-        self.table.setSortingEnabled(True)
+    def closeEvent(self, event):
+        self.scheduler.stop(timeout=1)
+        super().closeEvent(event)
 
     def open_anilist(self, index):
         """Open the AniList page for the double-clicked anime."""
-        row = index.row()
-        title_item = self.table.item(row, 1)
-        if title_item:
-            anime_id = title_item.data(Qt.UserRole)
-            if anime_id:
-                webbrowser.open(f"https://anilist.co/anime/{anime_id}")
+        anime_id = index.data(Qt.UserRole)
+        if anime_id:
+            webbrowser.open(f"https://anilist.co/anime/{anime_id}")
 
 
 if __name__ == '__main__':
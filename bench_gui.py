@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+# Must be set before the QApplication is created
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QApplication
+from pFactor import groupResults
+from GUI import MainWindow, COLUMNS
+
+DEFAULT_SIZES = (1000, 10000, 50000)
+SCROLL_FRAMES = 200
+GENRES = ['Action', 'Adventure', 'Comedy', 'Drama', 'Fantasy', 'Mystery',
+          'Romance', 'Sci-Fi', 'Slice of Life', 'Sports', 'Supernatural', 'Thriller']
+WORDS = ['Shingeki', 'Kimetsu', 'no', 'Kyojin', 'Yaiba', 'Monogatari', 'Hagane', 'Renkinjutsushi',
+         'Steins', 'Gate', 'Koukaku', 'Kidoutai', 'Mushishi', 'Natsume', 'Yuujinchou', 'Gintama']
+
+
+def syntheticResults(count, seed=0):
+    """
+    getPFactorData-shaped rows for count anime. Roughly a third belong to
+    franchise chains of 2-6 titles, which groupResults groups as it would real data.
+    """
+    rng = random.Random(seed)
+    rows = []
+    while len(rows) < count:
+        chain = rng.choice((1, 1, 1, 1, 2, 3, 4, 6))
+        chain = min(chain, count - len(rows))
+        base = ' '.join(rng.sample(WORDS, 3))
+        first_id = len(rows) + 1
+        for k in range(chain):
+            media_id = first_id + k
+            eps = rng.choice((1, 12, 13, 24, 25, 26, 50))
+            duration = rng.choice((24, 24, 23, 12, 100))
+            score = rng.randint(55, 92)
+            relations = []
+            if k > 0:
+                relations.append({'id': media_id - 1, 'relationType': 'PREQUEL',
+                                  'title': f"{base} {k}"})
+            if k < chain - 1:
+                relations.append({'id': media_id + 1, 'relationType': 'SEQUEL',
+                                  'title': f"{base} {k + 2}"})
+            pf = round(rng.uniform(0.5, 1.2), 2) if k and rng.random() < 0.5 else 0
+            rows.append({
+                'id': media_id,
+                'title': f"{base} {k + 1}" if chain > 1 else base,
+                'APL': round(score * rng.uniform(0.8, 1.1), 2),
+                'averageScore': score,
+                'episodes': eps,
+                'duration': duration,
+                'watchTime': round(eps * duration / 60, 1),
+                'pfactor': pf,
+                'bfactor': round(rng.uniform(0, 0.3), 2),
+                'gfactor': round(rng.uniform(0, 0.06), 3),
+                'popfactor': round(rng.uniform(0, 0.04), 3),
+                'genres': rng.sample(GENRES, 3),
+                'relation': "Sequel to " + base if pf else None,
+                'dataAge': rng.uniform(0, 7 * 86400),
+                'stale': rng.random() < 0.05,
+                'unresolved': False,
+                '_relations': relations,
+            })
+    rows = groupResults(rows)
+    for row in rows:
+        row.pop('_relations', None)
+    return rows
+
+
+class BenchWindow(MainWindow):
+    """MainWindow that leaves saved users alone, so the refresh scheduler stays idle."""
+
+    def _load_userdata(self):
+        pass
+
+
+def _rss_mb():
+    """Current resident set size in MB, or None where it can't be read."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2 ** 20
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _settle(app):
+    """Process events until Qt has no deferred work (zero-timer layouts, resizes) left."""
+    idle = 0
+    while idle < 2:
+        start = time.perf_counter()
+        app.processEvents()
+        idle = idle + 1 if time.perf_counter() - start < 0.001 else 0
+
+
+def _timed(app, fn):
+    """
+    Run fn and let Qt finish the resulting work; returns elapsed milliseconds.
+    Work left over from earlier steps is flushed first so it isn't counted here.
+    """
+    _settle(app)
+    start = time.perf_counter()
+    fn()
+    _settle(app)
+    return (time.perf_counter() - start) * 1000
+
+
+def _scroll(app, table, frames):
+    """Repaint times (ms) while paging down through the table and back up."""
+    bar = table.verticalScrollBar()
+    viewport = table.viewport()
+    step = max(bar.pageStep(), 1)
+    times = []
+    value = 0
+    direction = 1
+    for _ in range(frames):
+        value += direction * step
+        if value >= bar.maximum() or value <= 0:
+            direction = -direction
+            value = max(0, min(value, bar.maximum()))
+        start = time.perf_counter()
+        bar.setValue(value)
+        viewport.repaint()
+        times.append((time.perf_counter() - start) * 1000)
+    app.processEvents()
+    times.sort()
+    return {
+        'mean': sum(times) / len(times),
+        'p95': times[int(len(times) * 0.95) - 1],
+        'max': times[-1],
+    }
+
+
+def benchSize(app, count, frames=SCROLL_FRAMES, group_sort=True):
+    """Run every measurement for one result size and return the numbers."""
+    data = syntheticResults(count)
+    rss_before = _rss_mb()
+
+    window = BenchWindow()
+    window.scheduler.stop(timeout=1)
+    window.resize(1100, 700)
+    window.show()
+    app.processEvents()
+
+    result = {'rows': count}
+    result['load_ms'] = _timed(app, lambda: window.on_result(data))
+    rss_after = _rss_mb()
+    if rss_before is not None and rss_after is not None:
+        result['memory_mb'] = rss_after - rss_before
+    result['reload_ms'] = _timed(app, lambda: window.on_result(syntheticResults(count, seed=1)))
+    result['populate_ms'] = _timed(app, lambda: window._populate_table(window.data))
+
+    table = window.table
+    result['sort_ms'] = {
+        name: _timed(app, lambda col=col: table.sortByColumn(col, Qt.DescendingOrder))
+        for col, name in enumerate(COLUMNS)
+    }
+    if group_sort:
+        window.chk_group_sort.setChecked(True)
+        result['group_sort_ms'] = {
+            name: _timed(app, lambda col=col: table.sortByColumn(col, Qt.DescendingOrder))
+            for col, name in enumerate(COLUMNS)
+        }
+        window.chk_group_sort.setChecked(False)
+
+    table.sortByColumn(2, Qt.DescendingOrder)
+    result['scroll_ms'] = _scroll(app, table, frames)
+    result['filter_ms'] = _timed(app, lambda: window.filter_input.setText('apl>80 eps<=26'))
+    result['filtered_scroll_ms'] = _scroll(app, table, frames)
+    result['unfilter_ms'] = _timed(app, lambda: window.filter_input.setText(''))
+
+    window.close()
+    window.deleteLater()
+    app.processEvents()
+    return result
+
+
+def _report(result):
+    lines = [f"--- {result['rows']:,} rows ---"]
+    for key, label in (('load_ms', 'on_result (first load)'), ('reload_ms', 'on_result (reload)'),
+                       ('populate_ms', '_populate_table'), ('filter_ms', 'filter apl>80 eps<=26'),
+                       ('unfilter_ms', 'clear filter')):
+        lines.append(f"  {label:<26} {result[key]:>9.1f} ms")
+    if 'memory_mb' in result:
+        lines.append(f"  {'memory (RSS growth)':<26} {result['memory_mb']:>9.1f} MB")
+    for key, label in (('scroll_ms', 'scroll repaint'), ('filtered_scroll_ms', 'scroll repaint (filtered)')):
+        s = result[key]
+        lines.append(f"  {label:<26} {s['mean']:>9.2f} ms mean  {s['p95']:.2f} p95  {s['max']:.2f} max")
+    lines.append(f"  {'sort':<26} {'plain':>9}  {'grouped':>9}")
+    grouped = result.get('group_sort_ms', {})
+    for name, ms in result['sort_ms'].items():
+        g = f"{grouped[name]:>9.1f}" if name in grouped else f"{'-':>9}"
+        lines.append(f"    {name:<24} {ms:>9.1f}  {g} ms")
+    return '\n'.join(lines)
+
+
+def _flatten(result, prefix=''):
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif key != 'rows':
+            flat[prefix + key] = value
+    return flat
+
+
+def compareBaseline(results, baseline, tolerance):
+    """Lines for every metric more than tolerance times slower than in baseline."""
+    previous = {r['rows']: _flatten(r) for r in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(result['rows'])
+        if old is None:
+            continue
+        for key, value in _flatten(result).items():
+            before = old.get(key)
+            # Ignore sub-millisecond timings; they are mostly noise
+            if before and value > 1 and value > before * tolerance:
+                regressions.append(
+                    f"{result['rows']:,} rows {key}: {before:.1f} -> {value:.1f} ({value / before:.1f}x)"
+                )
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless GUI benchmarks for large result sets")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="result set sizes to benchmark (default: 1000 10000 50000)")
+    parser.add_argument('--frames', type=int, default=SCROLL_FRAMES,
+                        help="repaints per scroll measurement")
+    parser.add_argument('--no-group-sort', action='store_true',
+                        help="skip the group-aware sort measurements")
+    parser.add_argument('--json', metavar='FILE', help="write results to FILE")
+    parser.add_argument('--baseline', metavar='FILE',
+                        help="compare with results saved by --json; exit 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help="slowdown factor counted as a regression (default: 1.5)")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    results = []
+    for size in args.sizes:
+        result = benchSize(app, size, args.frames, group_sort=not args.no_group_sort)
+        print(_report(result), flush=True)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compareBaseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            print('\n'.join(f"  {line}" for line in regressions))
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
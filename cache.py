@@ -2,56 +2,278 @@ import json
 import os
 import time
 import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _lock_file(f):
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue  # LK_LOCK gives up after ~10s, keep waiting
+
+    def _unlock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
 
 CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
 DEFAULT_TTL = 3600       # 1 hour for user list data
 RELATIONS_TTL = 604800   # 7 days for relation data (rarely changes)
 
+DAY = 86400
+REPLACE_RETRIES = 10   # Windows refuses to replace a file a reader has open
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on path (created if missing) across processes."""
+    with open(path, 'a+') as f:
+        _lock_file(f)
+        try:
+            yield
+        finally:
+            _unlock_file(f)
+
+
+def atomic_write(path, obj):
+    """
+    Write obj to path as JSON via a temp file renamed over it, so readers
+    see either the old file or the new one, never a partial write.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(obj, f)
+        for attempt in range(REPLACE_RETRIES):
+            try:
+                os.replace(tmp_path, path)
+                return
+            except PermissionError:
+                if attempt == REPLACE_RETRIES - 1:
+                    raise
+                time.sleep(0.01 * (attempt + 1))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def format_age(seconds):
+    """Short human-readable cache age, e.g. '12m', '3.5h', '2.1d'."""
+    if seconds is None:
+        return "missing"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f}m"
+    if seconds < DAY:
+        return f"{seconds / 3600:.1f}h"
+    return f"{seconds / DAY:.1f}d"
+
+
+class TTLPolicy:
+    """
+    Picks an expiry per cache entry instead of one flat TTL per namespace.
+
+    Relations are keyed off the media's airing status and whether any related
+    anime is still airing or announced; user lists off how recently the list
+    last changed. Entries that keep coming back unchanged earn longer TTLs.
+    """
+
+    # Relation TTL by the queried media's status
+    RELATIONS_BY_STATUS = {
+        'FINISHED': 30 * DAY,
+        'CANCELLED': 90 * DAY,
+        'HIATUS': 7 * DAY,
+        'RELEASING': 1 * DAY,
+        'NOT_YET_RELEASED': 1 * DAY,
+    }
+    # Related anime in these states mean sequels/airing changes are likely
+    VOLATILE_STATUSES = {'RELEASING', 'NOT_YET_RELEASED'}
+    VOLATILE_RELATIONS_TTL = 2 * DAY
+    MAX_RELATIONS_TTL = 180 * DAY
+
+    MIN_LISTS_TTL = 900           # 15 min while the list is actively changing
+    MAX_LISTS_TTL = 6 * 3600      # 6 hours for lists left untouched for days
+    LISTS_ACTIVITY_FACTOR = 0.05  # list TTL grows with 5% of its unchanged time
+
+    def relations(self, media_status, relations, unchanged_for=0):
+        ttl = self.RELATIONS_BY_STATUS.get(media_status, RELATIONS_TTL)
+        volatile = media_status in self.VOLATILE_STATUSES or any(
+            rel.get('status') in self.VOLATILE_STATUSES for rel in relations
+        )
+        if volatile:
+            return min(ttl, self.VOLATILE_RELATIONS_TTL)
+        # Stable franchises: keep for half as long as they have been unchanged
+        return min(max(ttl, unchanged_for * 0.5), self.MAX_RELATIONS_TTL)
+
+    def lists(self, unchanged_for=0):
+        ttl = unchanged_for * self.LISTS_ACTIVITY_FACTOR
+        return min(max(ttl, self.MIN_LISTS_TTL), self.MAX_LISTS_TTL)
+
 
 class Cache:
+    """
+    JSON-file cache shared safely between threads and processes.
+
+    Writes go to a temp file that is atomically renamed over the entry, so
+    readers never see a partial file and need no locking. Writers take a
+    per-namespace file lock, which callers can also hold via locked() for
+    read-modify-write updates.
+    """
+
     def __init__(self):
         os.makedirs(CACHE_DIR, exist_ok=True)
+        self._held = threading.local()
 
-    def _path(self, namespace, key):
-        safe_key = str(key).replace('/', '_').replace('\\', '_')
+    def _ns_dir(self, namespace):
         ns_dir = os.path.join(CACHE_DIR, namespace)
         os.makedirs(ns_dir, exist_ok=True)
-        return os.path.join(ns_dir, f"{safe_key}.json")
+        return ns_dir
 
-    def get(self, namespace, key, ttl=DEFAULT_TTL):
+    def _path(self, namespace, key):
+        safe_key = str(key).replace('/', '_').replace('\\', '_')
+        return os.path.join(self._ns_dir(namespace), f"{safe_key}.json")
+
+    @contextmanager
+    def locked(self, namespace):
+        """Hold the namespace's write lock (re-entrant within a thread)."""
+        held = self._held.__dict__.setdefault('namespaces', set())
+        if namespace in held:
+            yield
+            return
+        with file_lock(os.path.join(self._ns_dir(namespace), '.lock')):
+            held.add(namespace)
+            try:
+                yield
+            finally:
+                held.discard(namespace)
+
+    def _read(self, namespace, key):
         path = self._path(namespace, key)
         if not os.path.exists(path):
             return None
         try:
             with open(path, 'r', encoding='utf-8') as f:
                 entry = json.load(f)
-            if time.time() - entry['ts'] > ttl:
-                return None
-            return entry['data']
-        except (json.JSONDecodeError, KeyError, IOError):
+        except (json.JSONDecodeError, IOError):
+            return None
+        if not isinstance(entry, dict) or 'ts' not in entry or 'data' not in entry:
             return None
+        return entry
 
-    def set(self, namespace, key, data):
-        path = self._path(namespace, key)
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump({'ts': time.time(), 'data': data}, f)
+    def get(self, namespace, key, ttl=DEFAULT_TTL):
+        """
+        Returns cached data, or None if missing or expired.
+        An expiry stored with the entry takes precedence over ttl.
+        """
+        entry = self._read(namespace, key)
+        if entry is None:
+            return None
+        if time.time() - entry['ts'] > entry.get('ttl', ttl):
+            return None
+        return entry['data']
+
+    def lookup(self, namespace, key, ttl=DEFAULT_TTL):
+        """
+        Returns (data, age, ttl) regardless of expiry, or (None, None, None)
+        if not cached. ttl is the entry's own expiry, else the given default.
+        """
+        entry = self._read(namespace, key)
+        if entry is None:
+            return None, None, None
+        return entry['data'], time.time() - entry['ts'], entry.get('ttl', ttl)
+
+    def peek(self, namespace, key):
+        """Returns cached data regardless of age, or None if not cached."""
+        entry = self._read(namespace, key)
+        return entry['data'] if entry is not None else None
+
+    def set(self, namespace, key, data, ttl=None, fingerprint=None):
+        """
+        Stores data, optionally with its own expiry in seconds.
+        fingerprint, if given, is what change tracking compares instead of data.
+        """
+        current = data if fingerprint is None else fingerprint
+        with self.locked(namespace):
+            now = time.time()
+            previous = self._read(namespace, key)
+            if previous is not None and self._fingerprint(previous) == current:
+                changed = previous.get('changed', previous['ts'])
+            else:
+                changed = now
+            entry = {'ts': now, 'changed': changed, 'data': data}
+            if ttl is not None:
+                entry['ttl'] = ttl
+            if fingerprint is not None:
+                entry['fp'] = fingerprint
+            try:
+                atomic_write(self._path(namespace, key), entry)
+            except FileNotFoundError:
+                # Cache was cleared mid-write; store into the fresh directory
+                atomic_write(self._path(namespace, key), entry)
+
+    @staticmethod
+    def _fingerprint(entry):
+        return entry.get('fp', entry['data'])
+
+    def unchanged_for(self, namespace, key, current=None):
+        """
+        Seconds since the cached data last changed, or 0 if not cached.
+        If current (data or fingerprint) is given, returns 0 unless it matches.
+        """
+        entry = self._read(namespace, key)
+        if entry is None or (current is not None and self._fingerprint(entry) != current):
+            return 0
+        return time.time() - entry.get('changed', entry['ts'])
+
+    def ttl(self, namespace, key, default=DEFAULT_TTL):
+        """Returns the expiry stored with an entry, or default."""
+        entry = self._read(namespace, key)
+        if entry is None:
+            return default
+        return entry.get('ttl', default)
+
+    def delete(self, namespace, key):
+        with self.locked(namespace):
+            path = self._path(namespace, key)
+            if os.path.exists(path):
+                os.remove(path)
 
     def clear(self):
+        """
+        Delete all cached data. The directory is renamed away first so
+        concurrent readers and writers see an empty cache, never a half-deleted one.
+        """
         if os.path.exists(CACHE_DIR):
-            shutil.rmtree(CACHE_DIR)
+            trash = f"{CACHE_DIR}.trash-{os.getpid()}-{time.time_ns()}"
+            try:
+                os.rename(CACHE_DIR, trash)
+            except OSError:
+                # Windows can't rename a directory with open files; delete in place
+                trash = CACHE_DIR
+            shutil.rmtree(trash, ignore_errors=True)
         os.makedirs(CACHE_DIR, exist_ok=True)
 
     def age(self, namespace, key):
         """Returns cache age in seconds, or None if not cached."""
-        path = self._path(namespace, key)
-        if not os.path.exists(path):
-            return None
-        try:
-            with open(path, 'r', encoding='utf-8') as f:
-                entry = json.load(f)
-            return time.time() - entry['ts']
-        except (json.JSONDecodeError, KeyError, IOError):
+        entry = self._read(namespace, key)
+        if entry is None:
             return None
+        return time.time() - entry['ts']
 
 
 cache = Cache()
+ttl_policy = TTLPolicy()
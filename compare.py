@@ -0,0 +1,154 @@
+import sys
+from collections import defaultdict
+from search import fetchAllLists, getRelationsData
+from pFactor import isEligible, scoringContext, scoreAnime
+
+WATCHED_STATUSES = ('COMPLETED', 'CURRENT', 'REPEATING')
+
+
+class ListComparison:
+    """
+    Compares the anime lists of several users.
+
+    Builds an inverted index of status -> media ID -> bitmask of users, so
+    queries like "in everyone's PLANNING" or "completed by X and planned by Y"
+    are a few integer AND operations per title instead of repeated list scans.
+    Media data and relations are stored once and shared between users.
+    """
+
+    def __init__(self, usernames, all_lists=None, progress_callback=None):
+        """
+        usernames: users to compare, in display order.
+        all_lists: optional username -> fetchAllLists() result, to skip fetching.
+        """
+        self.users = list(dict.fromkeys(usernames))
+        self.bits = {user: 1 << i for i, user in enumerate(self.users)}
+        self.all_mask = (1 << len(self.users)) - 1
+        self.lists = {}
+        self.media = {}                                    # media ID -> media dict
+        self.index = defaultdict(lambda: defaultdict(int))  # status -> media ID -> user mask
+        self.relations = {}                                 # media ID -> relations (shared)
+        self._contexts = {}
+
+        for i, user in enumerate(self.users):
+            if progress_callback:
+                progress_callback(i, len(self.users), f"Fetching lists for {user}...")
+            lists = all_lists[user] if all_lists and user in all_lists else fetchAllLists(user)
+            self.add_user_lists(user, lists)
+
+    def add_user_lists(self, user, lists):
+        """Index one user's lists. The user must be one of self.users."""
+        self.lists[user] = lists
+        self._contexts.pop(user, None)
+        bit = self.bits[user]
+        for status, entries in lists.items():
+            by_id = self.index[status]
+            for anime in entries:
+                media_id = anime['id']
+                by_id[media_id] |= bit
+                self.media.setdefault(media_id, anime)
+
+    def mask(self, users=None):
+        """Bitmask for a collection of usernames (all users if None)."""
+        if users is None:
+            return self.all_mask
+        m = 0
+        for user in users:
+            m |= self.bits[user]
+        return m
+
+    def users_for(self, media_id, status):
+        """Usernames that have media_id in the given status."""
+        m = self.index[status].get(media_id, 0)
+        return [u for u in self.users if m & self.bits[u]]
+
+    def shared(self, status='PLANNING', users=None):
+        """Media IDs every given user (default all) has in status."""
+        m = self.mask(users)
+        return [mid for mid, um in self.index[status].items() if um & m == m]
+
+    def any_of(self, status='PLANNING', users=None):
+        """Media IDs at least one given user (default all) has in status."""
+        m = self.mask(users)
+        return [mid for mid, um in self.index[status].items() if um & m]
+
+    def cross(self, user, status, other, other_status):
+        """Media IDs user has in status that other has in other_status."""
+        bit, other_bit = self.bits[user], self.bits[other]
+        source, target = self.index[status], self.index[other_status]
+        if len(target) < len(source):
+            source, target = target, source
+            bit, other_bit = other_bit, bit
+        return [mid for mid, um in source.items()
+                if um & bit and target.get(mid, 0) & other_bit]
+
+    def completed_in_planning(self, friend, user):
+        """What friend completed (or is repeating) that is in user's PLANNING."""
+        ids = set(self.cross(friend, 'COMPLETED', user, 'PLANNING'))
+        ids.update(self.cross(friend, 'REPEATING', user, 'PLANNING'))
+        return sorted(ids)
+
+    def _context(self, user):
+        if user not in self._contexts:
+            self._contexts[user] = scoringContext(user, self.lists[user])
+        return self._contexts[user]
+
+    def _relations(self, media_id):
+        if media_id not in self.relations:
+            self.relations[media_id] = getRelationsData(media_id)
+        return self.relations[media_id]
+
+    def ranked(self, media_ids=None, users=None, progress_callback=None):
+        """
+        Rank titles by combined APL, the mean of each user's APL for the title.
+        Defaults to the eligible titles in every given user's PLANNING list.
+        Relations are fetched once per title and shared between users.
+
+        Returns list of dicts with 'id', 'title', 'APL' (combined) and 'perUser'.
+        """
+        users = list(self.users if users is None else users)
+        if media_ids is None:
+            media_ids = [mid for mid in self.shared('PLANNING', users)
+                         if isEligible(self.media[mid])]
+
+        results = []
+        total = len(media_ids)
+        for i, media_id in enumerate(media_ids):
+            anime = self.media[media_id]
+            if progress_callback:
+                progress_callback(i, total, f"Scoring {anime['title']['romaji'][:30]}")
+            relations = self._relations(media_id)
+            per_user = {}
+            for user in users:
+                row = scoreAnime(anime, relations, self._context(user))
+                per_user[user] = row['APL']
+            results.append({
+                'id': media_id,
+                'title': anime['title']['romaji'],
+                'APL': round(sum(per_user.values()) / len(per_user), 2) if per_user else 0,
+                'perUser': per_user,
+            })
+
+        results.sort(key=lambda r: r['APL'], reverse=True)
+        return results
+
+
+def compare(usernames):
+    comparison = ListComparison(usernames)
+    results = comparison.ranked()
+    if not results:
+        print("No anime found in everyone's planning list.")
+        return
+
+    print(f"\n{'#':>3} {'Title':<40} {'APL':>6}  " + "  ".join(f"{u[:10]:>10}" for u in comparison.users))
+    print("-" * (52 + 12 * len(comparison.users)))
+    for i, row in enumerate(results, 1):
+        per_user = "  ".join(f"{row['perUser'][u]:>10}" for u in comparison.users)
+        print(f"{i:>3} {row['title'][:39]:<40} {row['APL']:>6}  {per_user}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: python compare.py <username> <username> [username ...]")
+        sys.exit(1)
+    compare(sys.argv[1:])
@@ -0,0 +1,136 @@
+import sys
+from cache import cache, DAY
+from search import loadLists, lookupRelations, getMediaBatch, ONLINE, CACHE_ONLY, CacheMiss
+from pFactor import isEligible, scoringContext, scoreAnime
+
+SEED_STATUSES = ('COMPLETED', 'CURRENT', 'REPEATING')
+DISCOVERY_RELATIONS = {'SEQUEL'}
+MAX_DEPTH = 2   # sequels of sequels you haven't added either
+
+
+def _cached(anime_id, lookup, mode):
+    """Cached value if it can be used in this mode, else None."""
+    data, age, ttl = lookup(anime_id)
+    if data is not None and (age <= ttl or mode != ONLINE):
+        return data
+    return None
+
+
+def _lookup_media(anime_id):
+    return cache.lookup('media', str(anime_id), DAY)
+
+
+def discoverSequels(username, all_lists=None, max_depth=MAX_DEPTH, mode=ONLINE,
+                    progress_callback=None):
+    """
+    Find sequels to titles the user completed or is watching that are on none
+    of their lists, and score them like planning entries.
+
+    Walks SEQUEL relations breadth-first from COMPLETED/CURRENT/REPEATING
+    titles. Relations come from the cache (and relation snapshot) where
+    possible. Everything still missing at a level is fetched with
+    getMediaBatch, one batched request per MEDIA_BATCH_SIZE titles instead
+    of one per title. Candidates up to max_depth steps from a watched title
+    are kept.
+
+    Returns result rows (see scoreAnime) sorted by APL, each with 'depth'
+    (1 = direct sequel of a watched title) and 'via' (the title it follows).
+    """
+    if all_lists is None:
+        all_lists, _, _ = loadLists(username, mode)
+
+    on_list = {a['id'] for entries in all_lists.values() for a in entries}
+    seeds = {a['id']: a for status in SEED_STATUSES for a in all_lists.get(status, [])}
+
+    relations_of = {}
+    media = {}        # candidate ID -> media record
+    # Every frontier title is a seed or was reached by a relation edge naming
+    # it, so its title is known even when its media record couldn't be fetched
+    titles = {anime_id: anime['title']['romaji'] for anime_id, anime in seeds.items()}
+    found = {}        # candidate ID -> (depth, title it follows)
+    frontier = list(seeds)
+    visited = set(frontier)
+
+    for depth in range(max_depth + 1):
+        if not frontier:
+            break
+        missing = []
+        for anime_id in frontier:
+            relations = _cached(anime_id, lookupRelations, mode)
+            if relations is not None:
+                relations_of[anime_id] = relations
+            if anime_id not in seeds:
+                record = _cached(anime_id, _lookup_media, mode)
+                if record is not None:
+                    media[anime_id] = record
+            if anime_id not in relations_of or (anime_id not in seeds and anime_id not in media):
+                missing.append(anime_id)
+
+        if missing and mode != CACHE_ONLY:
+            if progress_callback:
+                progress_callback(depth, max_depth + 1,
+                                  f"Level {depth}: fetching {len(missing)} titles...")
+            for anime_id, (record, relations) in getMediaBatch(missing).items():
+                relations_of[anime_id] = relations
+                if anime_id not in seeds:
+                    media[anime_id] = record
+
+        if depth == max_depth:
+            break
+        next_frontier = []
+        for anime_id in frontier:
+            for rel in relations_of.get(anime_id, []):
+                rel_id = rel['id']
+                if (rel['relationType'] not in DISCOVERY_RELATIONS
+                        or rel_id in visited or rel_id in on_list):
+                    continue
+                visited.add(rel_id)
+                next_frontier.append(rel_id)
+                titles[rel_id] = rel['title']
+                found[rel_id] = (depth + 1, titles[anime_id])
+        frontier = next_frontier
+
+    context = scoringContext(username, all_lists)
+    results = []
+    for anime_id, (depth, via) in found.items():
+        anime = media.get(anime_id)
+        if anime is None or not isEligible(anime):
+            continue
+        row = scoreAnime(anime, relations_of.get(anime_id, []), context)
+        row.pop('_relations', None)
+        row['depth'] = depth
+        row['via'] = via
+        results.append(row)
+
+    results.sort(key=lambda r: r['APL'], reverse=True)
+    return results
+
+
+def discover(username, mode=ONLINE):
+    def progress(current, total, message):
+        print(f"\r[{current}/{total}] {message}", end='', flush=True)
+
+    try:
+        results = discoverSequels(username, mode=mode, progress_callback=progress)
+    except CacheMiss as e:
+        print(f"{e}. Run once without --offline to fetch it.")
+        return
+    print()
+    if not results:
+        print("No missing sequels found.")
+        return
+
+    print(f"\n{'#':>3} {'Title':<40} {'APL':>6} {'Score':>5} {'Eps':>4}  Follows")
+    print("-" * 100)
+    for i, row in enumerate(results, 1):
+        follows = row['via'] if row['depth'] == 1 else f"{row['via']} (not on your list)"
+        print(f"{i:>3} {row['title'][:39]:<40} {row['APL']:>6} {row['averageScore']:>5} "
+              f"{row['episodes']:>4}  {follows}")
+
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if a != '--offline']
+    if len(args) != 1:
+        print("Usage: python discover.py <username> [--offline]")
+        sys.exit(1)
+    discover(args[0], mode=CACHE_ONLY if '--offline' in sys.argv else ONLINE)
@@ -0,0 +1,148 @@
+import re
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from itertools import chain
+
+# Filter field name -> result key
+FIELDS = {
+    'apl': 'APL',
+    'score': 'averageScore',
+    'eps': 'episodes',
+    'hours': 'watchTime',
+    'pf': 'pfactor',
+}
+
+_RANGE_TOKEN = re.compile(r'^(%s)(<=|>=|<|>|=)(\d+(?:\.\d+)?)$' % '|'.join(FIELDS))
+SEQUEL_KEYWORDS = {'sequel', 'sequels'}
+SEQUEL_LABEL = 'Sequel to'
+
+
+def parseQuery(text):
+    """
+    Parse filter bar text into a query dict.
+
+    Tokens like 'apl>85', 'eps<=13', 'hours<10', 'score>=80', 'pf>0' become
+    range filters, 'sequels' keeps only sequels, and the remaining words are a
+    case-insensitive title substring search ('^' prefix for a prefix search).
+    """
+    ranges = []
+    sequels = False
+    words = []
+    for token in text.split():
+        match = _RANGE_TOKEN.match(token.lower())
+        if match:
+            ranges.append((match.group(1), match.group(2), float(match.group(3))))
+        elif token.lower() in SEQUEL_KEYWORDS:
+            sequels = True
+        else:
+            words.append(token)
+
+    title = ' '.join(words).lower()
+    prefix = title.startswith('^')
+    if prefix:
+        title = title[1:]
+    return {'title': title, 'prefix': prefix, 'ranges': ranges, 'sequels': sequels}
+
+
+class ResultIndex:
+    """
+    Search and range indexes over getPFactorData results for live filtering.
+
+    Numeric fields are kept as sorted (value, position) columns so a range
+    filter is two bisects, titles as a sorted list for prefix search and as one
+    newline-joined string with row offsets, so substring search is a run of
+    C-level str.find calls. Queries return sets of positions into the data list.
+    """
+
+    def __init__(self, data):
+        self.size = len(data)
+        self.titles = [a['title'].lower() for a in data]
+
+        prefix_sorted = sorted((t, i) for i, t in enumerate(self.titles))
+        self._prefix_keys = [t for t, _ in prefix_sorted]
+        self._prefix_ids = [i for _, i in prefix_sorted]
+        self._haystack = '\n'.join(self.titles)
+        self._offsets = []
+        offset = 0
+        for title in self.titles:
+            self._offsets.append(offset)
+            offset += len(title) + 1
+
+        self._columns = {}
+        for name, key in FIELDS.items():
+            pairs = sorted((a.get(key) or 0, i) for i, a in enumerate(data))
+            self._columns[name] = ([v for v, _ in pairs], [i for _, i in pairs])
+
+        self._sequels = {
+            i for i, a in enumerate(data)
+            if (a.get('relation') or '').startswith(SEQUEL_LABEL)
+        }
+
+        self._group_members = defaultdict(list)
+        self._group_of = {}
+        for i, a in enumerate(data):
+            if a.get('groupSize', 1) > 1:
+                self._group_members[a['group']].append(i)
+                self._group_of[i] = a['group']
+
+    def search(self, text, prefix=False):
+        """Positions whose title contains (or starts with) text, case-insensitive."""
+        text = text.lower()
+        if prefix:
+            lo = bisect_left(self._prefix_keys, text)
+            hi = bisect_left(self._prefix_keys, text + '\uffff')
+            return set(self._prefix_ids[lo:hi])
+
+        if len(text) < 3 or self._haystack.count(text) * 8 > self.size:
+            # Needles matching many titles: a plain scan beats per-hit bookkeeping
+            return {i for i, t in enumerate(self.titles) if text in t}
+
+        matched = set()
+        haystack, offsets = self._haystack, self._offsets
+        pos = haystack.find(text)
+        while pos != -1:
+            row = bisect_right(offsets, pos) - 1
+            matched.add(row)
+            # Skip to the next title so each row is found once
+            next_start = offsets[row + 1] if row + 1 < len(offsets) else len(haystack)
+            pos = haystack.find(text, next_start)
+        return matched
+
+    def range(self, field, op, value):
+        """Positions whose field satisfies 'field op value'."""
+        values, ids = self._columns[field]
+        if op == '>':
+            return set(ids[bisect_right(values, value):])
+        if op == '>=':
+            return set(ids[bisect_left(values, value):])
+        if op == '<':
+            return set(ids[:bisect_left(values, value)])
+        if op == '<=':
+            return set(ids[:bisect_right(values, value)])
+        return set(ids[bisect_left(values, value):bisect_right(values, value)])
+
+    def query(self, query, keep_groups=False):
+        """
+        Positions matching a parseQuery() dict, or None if the query is empty.
+        With keep_groups, a match pulls in the rest of its franchise group.
+        """
+        sets = [self.range(*r) for r in query['ranges']]
+        if query['sequels']:
+            sets.append(self._sequels)
+        if query['title']:
+            sets.append(self.search(query['title'], query['prefix']))
+        if not sets:
+            return None
+
+        sets.sort(key=len)
+        matched = set(sets[0])
+        for s in sets[1:]:
+            matched &= s
+            if not matched:
+                break
+
+        if keep_groups:
+            groups = set(map(self._group_of.get, matched))
+            groups.discard(None)
+            matched.update(chain.from_iterable(map(self._group_members.__getitem__, groups)))
+        return matched
@@ -0,0 +1,246 @@
+import sys
+import os
+import json
+import time
+from cache import format_age, atomic_write, file_lock
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Kept outside .cache so clearing the cache doesn't lose history
+HISTORY_DIR = os.path.join(BASE_DIR, '.history')
+KEYFRAME_INTERVAL = 100   # store a full state every this many runs
+
+
+def _empty_state():
+    return {'lists': {}, 'titles': {}, 'apl': {}}
+
+
+def diffState(old, new):
+    """
+    Delta between two states: list membership/status changes and APL changes
+    ([old, new] pairs). IDs are strings so deltas round-trip through JSON unchanged.
+    """
+    old_lists, new_lists = old['lists'], new['lists']
+    delta = {}
+
+    added = {mid: [s, new['titles'].get(mid, '')]
+             for mid, s in new_lists.items() if mid not in old_lists}
+    removed = {mid: [s, old['titles'].get(mid, '')]
+               for mid, s in old_lists.items() if mid not in new_lists}
+    status = {mid: [old_lists[mid], s]
+              for mid, s in new_lists.items() if mid in old_lists and old_lists[mid] != s}
+    if added:
+        delta['added'] = added
+    if removed:
+        delta['removed'] = removed
+    if status:
+        delta['status'] = status
+
+    if new.get('apl') is not None:
+        apl = {mid: [old['apl'].get(mid), v]
+               for mid, v in new['apl'].items() if old['apl'].get(mid) != v}
+        apl_removed = [mid for mid in old['apl'] if mid not in new['apl']]
+        if apl:
+            delta['apl'] = apl
+        if apl_removed:
+            delta['aplRemoved'] = apl_removed
+    return delta
+
+
+def applyDelta(state, delta):
+    """Apply a delta from diffState to a state in place."""
+    for mid, (s, title) in delta.get('added', {}).items():
+        state['lists'][mid] = s
+        state['titles'][mid] = title
+    for mid in delta.get('removed', {}):
+        state['lists'].pop(mid, None)
+        state['titles'].pop(mid, None)
+    for mid, (_, s) in delta.get('status', {}).items():
+        state['lists'][mid] = s
+    for mid, (_, apl) in delta.get('apl', {}).items():
+        state['apl'][mid] = apl
+    for mid in delta.get('aplRemoved', []):
+        state['apl'].pop(mid, None)
+    return state
+
+
+class HistoryStore:
+    """
+    Per-user history of list snapshots and APL rankings, stored as deltas.
+
+    Each run that changed something appends one JSON line to <user>.jsonl
+    holding only what changed since the previous recorded run (added, removed
+    and status-changed media IDs, and changed APL scores), with a full keyframe
+    every KEYFRAME_INTERVAL records. The latest state and delta are kept in
+    <user>.head.json so recording a run or asking what changed last time never
+    replays the log. Read the log with changes() as a cheap change feed.
+    """
+
+    def __init__(self, root=HISTORY_DIR):
+        self.root = root
+
+    def _base(self, username):
+        safe = str(username).replace('/', '_').replace('\\', '_')
+        os.makedirs(self.root, exist_ok=True)
+        return os.path.join(self.root, safe)
+
+    def _paths(self, username):
+        base = self._base(username)
+        return f"{base}.jsonl", f"{base}.head.json"
+
+    def _locked(self, username):
+        """Hold the user's history lock, so processes recording the same user take turns."""
+        return file_lock(f"{self._base(username)}.lock")
+
+    def _records(self, username):
+        log_path, _ = self._paths(username)
+        if not os.path.exists(log_path):
+            return
+        with open(log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue   # partial trailing line from an interrupted write
+
+    def _head(self, username):
+        _, head_path = self._paths(username)
+        try:
+            with open(head_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError):
+            pass
+        # Missing or damaged head: rebuild by replaying the log
+        head = {'state': _empty_state(), 'count': 0}
+        for record in self._records(username):
+            head['state'] = self._replay_one(head['state'], record)
+            head['count'] += 1
+        return head
+
+    @staticmethod
+    def _replay_one(state, record):
+        if record.get('type') == 'full':
+            return record['state']
+        return applyDelta(state, record.get('delta', {}))
+
+    def record(self, username, all_lists, results=None):
+        """
+        Record a run. all_lists is fetchAllLists() output; results, if given,
+        are full getPFactorData rows whose APL scores are tracked. Rows flagged
+        unresolved were scored without relations, so they keep their previous
+        APL instead of recording a drop that the next run would undo.
+        Returns the delta against the previous run. Runs that change nothing
+        return an empty delta and aren't written.
+        """
+        new = _empty_state()
+        for status, entries in all_lists.items():
+            for anime in entries:
+                mid = str(anime['id'])
+                new['lists'][mid] = status
+                new['titles'][mid] = anime['title']['romaji']
+
+        with self._locked(username):
+            head = self._head(username)
+            old = head['state']
+            if results is None:
+                new['apl'] = dict(old['apl'])
+            else:
+                new['apl'] = {}
+                for r in results:
+                    mid = str(r['id'])
+                    if not r.get('unresolved'):
+                        new['apl'][mid] = r['APL']
+                    elif mid in old['apl']:
+                        new['apl'][mid] = old['apl'][mid]
+
+            delta = diffState(old, new)
+            if not delta:
+                # Nothing to add, and the head keeps pointing at the last real change
+                return delta
+
+            count = head['count'] + 1
+            record = {'ts': time.time()}
+            if count % KEYFRAME_INTERVAL == 0:
+                record.update({'type': 'full', 'state': new, 'delta': delta})
+            else:
+                record.update({'type': 'delta', 'delta': delta})
+
+            log_path, head_path = self._paths(username)
+            with open(log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+            atomic_write(head_path, {'state': new, 'count': count,
+                                     'ts': record['ts'], 'delta': delta})
+            return delta
+
+    def changes(self, username, since=None):
+        """Change feed: (ts, delta) for every run after since (all runs if None)."""
+        return [
+            (r['ts'], r.get('delta', {}))
+            for r in self._records(username)
+            if since is None or r['ts'] > since
+        ]
+
+    def last_change(self, username):
+        """(ts, delta) of the most recent run that changed something, or None."""
+        head = self._head(username)
+        if not head['count']:
+            return None
+        if 'ts' not in head:
+            # Head rebuilt from the log; take the last record instead
+            ts, delta = self.changes(username)[-1]
+            return ts, delta
+        return head['ts'], head['delta']
+
+    def state_at(self, username, ts):
+        """Reconstruct the list/APL state as of the last run at or before ts."""
+        state = _empty_state()
+        for record in self._records(username):
+            if record['ts'] > ts:
+                break
+            state = self._replay_one(state, record)
+        return state
+
+    def titles(self, username):
+        """Media ID -> title for the latest recorded state."""
+        return self._head(username)['state']['titles']
+
+
+def formatDelta(delta, titles=None, limit=15):
+    """Human-readable lines describing a delta."""
+    titles = titles or {}
+    lines = []
+
+    def label(mid, fallback=''):
+        return titles.get(mid) or fallback or f"#{mid}"
+
+    for heading, key in (("Added", 'added'), ("Removed", 'removed')):
+        items = delta.get(key, {})
+        if items:
+            lines.append(f"{heading} ({len(items)}):")
+            for mid, (status, title) in list(items.items())[:limit]:
+                lines.append(f"  {label(mid, title)} [{status}]")
+    if delta.get('status'):
+        lines.append(f"Status changed ({len(delta['status'])}):")
+        for mid, (old, new) in list(delta['status'].items())[:limit]:
+            lines.append(f"  {label(mid)}: {old} -> {new}")
+    if delta.get('apl'):
+        lines.append(f"APL changed ({len(delta['apl'])}):")
+        for mid, (old, new) in list(delta['apl'].items())[:limit]:
+            lines.append(f"  {label(mid)}: {old if old is not None else 'new'} -> {new}")
+    return lines or ["No changes."]
+
+
+history = HistoryStore()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python history.py <username>")
+        sys.exit(1)
+    user = sys.argv[1]
+    last = history.last_change(user)
+    if last is None:
+        print(f"No history recorded for {user}.")
+        sys.exit(0)
+    ts, delta = last
+    print(f"Last change for {user} ({format_age(time.time() - ts)} ago):")
+    print('\n'.join(formatDelta(delta, history.titles(user))))
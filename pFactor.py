@@ -1,5 +1,9 @@
+import heapq
+import math
 from collections import defaultdict, deque
-from search import fetchAllLists, getRelationsData
+from cache import cache
+from history import history
+from search import loadLists, loadRelations, lookupRelations, ONLINE, CACHE_ONLY, FETCH_ERRORS
 
 # Relation type weights for P-Factor (sequel detection)
 RELATION_WEIGHTS = {
@@ -31,6 +35,26 @@ DISPLAY_RELATION = {
 FORWARD_RELATIONS = {'SEQUEL', 'SIDE_STORY', 'SPIN_OFF'}
 REVERSE_RELATIONS = {'PREQUEL', 'PARENT'}
 
+# Personal score influence on P-Factor: the watched title's score relative to
+# the user's mean score scales the relation bonus within these bounds
+MIN_SCORE_INFLUENCE = 0.5
+MAX_SCORE_INFLUENCE = 1.25
+
+# Genre preference: shrink per-genre means toward the user's overall mean by
+# this many pseudo-entries so genres with one or two titles don't dominate
+GENRE_PRIOR_COUNT = 3
+GENRE_MAX_BONUS = 0.06
+GENRE_FULL_BONUS_DIFF = 15   # genre mean this many points above overall mean = full bonus
+
+POPULARITY_MAX_BONUS = 0.04
+
+# Planning entries considered for ranking
+ALLOWED_FORMATS = {'TV', 'TV_SHORT'}
+
+# Consecutive fetch failures after which a run stops calling the API and
+# serves the remaining titles from cache
+MAX_FETCH_FAILURES = 3
+
 
 def bFactor(episodes, score):
     """
@@ -54,11 +78,14 @@ def bFactor(episodes, score):
         return 0
 
 
-def pFactor(relations, watched_ids):
+def pFactor(relations, watched_ids, watched_scores=None, mean_score=None):
     """
     Previous season factor: bonus for anime related to titles you've watched.
     Uses the highest-weighted matching relation type.
 
+    If watched_scores (id -> personal score) and mean_score are given, the bonus
+    is scaled by how the user rated the related title compared to their mean.
+
     Returns: (factor: float, relation_info: str or None)
     """
     best_weight = 0
@@ -67,6 +94,11 @@ def pFactor(relations, watched_ids):
     for rel in relations:
         if rel['id'] in watched_ids:
             weight = RELATION_WEIGHTS.get(rel['relationType'], 0)
+            user_score = watched_scores.get(rel['id']) if watched_scores else None
+            if user_score and mean_score:
+                influence = min(max(user_score / mean_score, MIN_SCORE_INFLUENCE),
+                                MAX_SCORE_INFLUENCE)
+                weight = round(weight * influence, 4)
             if weight > best_weight:
                 best_weight = weight
                 label = DISPLAY_RELATION.get(rel['relationType'], 'Related to')
@@ -75,14 +107,99 @@ def pFactor(relations, watched_ids):
     return best_weight, best_relation
 
 
-def aplCalc(score, p_val, b_val, p_weight=0.6, b_weight=0.4):
+def gFactor(genres, profile):
+    """
+    Genre preference factor: bonus for genres the user rates above their average.
+    profile is the genre profile from updateGenreProfile.
+
+    Returns: float in [0, 0.06] range
+    """
+    if not genres or not profile or not profile['total'][1]:
+        return 0
+
+    total_sum, total_count = profile['total']
+    overall_mean = total_sum / total_count
+
+    diffs = []
+    for genre in genres:
+        g_sum, g_count = profile['genres'].get(genre, (0, 0))
+        adjusted = (g_sum + GENRE_PRIOR_COUNT * overall_mean) / (g_count + GENRE_PRIOR_COUNT)
+        diffs.append(adjusted - overall_mean)
+
+    affinity = sum(diffs) / len(diffs)
+    return round(min(max(affinity / GENRE_FULL_BONUS_DIFF, 0), 1) * GENRE_MAX_BONUS, 4)
+
+
+def popFactor(popularity, trending):
+    """
+    Popularity factor: small bonus for widely watched and currently trending anime.
+    Popularity is log-scaled (1k users = 0, 1M users = full), trending caps at 50.
+
+    Returns: float in [0, 0.04] range
+    """
+    pop_part = 0
+    if popularity and popularity > 0:
+        pop_part = min(max((math.log10(popularity) - 3) / 3, 0), 1)
+    trend_part = min(max((trending or 0) / 50, 0), 1)
+    return round(POPULARITY_MAX_BONUS * (0.75 * pop_part + 0.25 * trend_part), 4)
+
+
+def aplCalc(score, p_val, b_val, p_weight=0.6, b_weight=0.4,
+            g_val=0, pop_val=0, g_weight=0.5, pop_weight=0.25):
     """
     Calculate APL priority score.
-    APL = Score x (1 + P*pWeight + B*bWeight)
+    APL = Score x (1 + P*pWeight + B*bWeight + G*gWeight + Pop*popWeight)
     """
     if not score:
         return 0
-    return round(score * (1 + p_val * p_weight + b_val * b_weight), 2)
+    bonus = p_val * p_weight + b_val * b_weight + g_val * g_weight + pop_val * pop_weight
+    return round(score * (1 + bonus), 2)
+
+
+def updateGenreProfile(username, all_lists):
+    """
+    Incrementally maintain a user's cached genre-preference profile.
+
+    The profile keeps per-genre [score sum, count] over scored COMPLETED entries,
+    plus the entries it was built from, so each run only applies the entries
+    that were added, removed or rescored since the last run.
+    """
+    with cache.locked('genres'):
+        profile = cache.peek('genres', username) or {'entries': {}, 'genres': {}, 'total': [0, 0]}
+        entries = profile['entries']
+        genre_totals = profile['genres']
+        total = profile['total']
+
+        def apply(score, genres, sign):
+            total[0] += sign * score
+            total[1] += sign
+            for genre in genres:
+                g = genre_totals.setdefault(genre, [0, 0])
+                g[0] += sign * score
+                g[1] += sign
+                if g[1] <= 0:
+                    del genre_totals[genre]
+
+        current = {}
+        for anime in all_lists.get('COMPLETED', []):
+            if anime.get('userScore'):
+                current[str(anime['id'])] = [anime['userScore'], anime.get('genres') or []]
+
+        changed = False
+        for media_id in list(entries):
+            if current.get(media_id) != entries[media_id]:
+                apply(entries[media_id][0], entries[media_id][1], -1)
+                del entries[media_id]
+                changed = True
+        for media_id, entry in current.items():
+            if media_id not in entries:
+                apply(entry[0], entry[1], 1)
+                entries[media_id] = entry
+                changed = True
+
+        if changed:
+            cache.set('genres', username, profile)
+    return profile
 
 
 def _sort_by_franchise_order(group):
@@ -214,78 +331,233 @@ def groupResults(results):
     return output
 
 
-def getPFactorData(username, progress_callback=None):
+def isEligible(anime):
+    """Whether an anime can be ranked (finished TV / TV_SHORT)."""
+    return anime.get('format') in ALLOWED_FORMATS and anime.get('status') == 'FINISHED'
+
+
+def planningEntries(all_lists):
+    """Planning list entries eligible for ranking (finished TV / TV_SHORT)."""
+    return [a for a in all_lists.get('PLANNING', []) if isEligible(a)]
+
+
+def scoringContext(username, all_lists):
+    """
+    Per-user inputs for scoreAnime: watched IDs, personal scores and genre profile.
+    """
+    watched_ids = set()
+    watched_scores = {}
+    for status in ('COMPLETED', 'CURRENT', 'REPEATING'):
+        for anime in all_lists.get(status, []):
+            watched_ids.add(anime['id'])
+            if anime.get('userScore'):
+                watched_scores[anime['id']] = anime['userScore']
+
+    profile = updateGenreProfile(username, all_lists)
+    mean_score = profile['total'][0] / profile['total'][1] if profile['total'][1] else None
+
+    return {
+        'watched_ids': watched_ids,
+        'watched_scores': watched_scores,
+        'profile': profile,
+        'mean_score': mean_score,
+    }
+
+
+def scoreAnime(anime, relations, context):
+    """Score a single planning entry. Returns a result row for the APL table."""
+    p_val, relation_info = pFactor(
+        relations, context['watched_ids'], context['watched_scores'], context['mean_score']
+    )
+    b_val = bFactor(anime.get('episodes'), anime.get('averageScore'))
+    g_val = gFactor(anime.get('genres'), context['profile'])
+    pop_val = popFactor(anime.get('popularity'), anime.get('trending'))
+    apl_score = aplCalc(anime.get('averageScore', 0), p_val, b_val,
+                        g_val=g_val, pop_val=pop_val)
+
+    eps = anime.get('episodes') or 0
+    dur = anime.get('duration') or 24
+    watch_hours = round((eps * dur) / 60, 1) if eps > 0 else 0
+
+    return {
+        'title': anime['title']['romaji'],
+        'APL': apl_score,
+        'averageScore': anime.get('averageScore', 0),
+        'episodes': eps,
+        'duration': dur,
+        'watchTime': watch_hours,
+        'pfactor': p_val,
+        'bfactor': b_val,
+        'gfactor': g_val,
+        'popfactor': pop_val,
+        'genres': anime.get('genres') or [],
+        'relation': relation_info,
+        'id': anime['id'],
+        '_relations': relations,
+    }
+
+
+def aplUpperBound(anime, context):
+    """
+    Highest APL an anime could reach once its relations are known.
+    Every factor except P is computable from list data alone, so the bound
+    assumes the best possible P-Factor (top relation weight at max score influence).
+    """
+    b_val = bFactor(anime.get('episodes'), anime.get('averageScore'))
+    g_val = gFactor(anime.get('genres'), context['profile'])
+    pop_val = popFactor(anime.get('popularity'), anime.get('trending'))
+    p_max = max(RELATION_WEIGHTS.values()) * MAX_SCORE_INFLUENCE
+    return aplCalc(anime.get('averageScore', 0), p_max, b_val, g_val=g_val, pop_val=pop_val)
+
+
+def getPFactorData(username, progress_callback=None, mode=ONLINE, revalidate=None,
+                   top_k=None):
     """
     Main calculation pipeline. Fetches user data and calculates APL scores.
     Groups related anime by franchise and orders by watch order within groups.
+
+    mode is a search cache mode; entries served stale go to revalidate(namespace, key).
+    top_k returns only the k best titles, fetching relations in aplUpperBound order
+    until no title left can beat the k-th. Titles that can't be fetched are scored
+    from cache or flagged 'unresolved' and checkpointed to be fetched first next run.
     """
     if progress_callback:
         progress_callback(0, 100, "Fetching anime lists...")
 
-    all_lists = fetchAllLists(username)
+    failures = 0   # consecutive fetch failures; the API is left alone once this trips
+    try:
+        all_lists, lists_age, lists_stale = loadLists(username, mode, revalidate)
+    except FETCH_ERRORS:
+        # Fall back to expired list data rather than failing the whole run
+        all_lists, lists_age, _ = cache.lookup('lists', username)
+        if all_lists is None:
+            raise
+        lists_stale = True
+        failures = 1
 
-    planning = all_lists.get('PLANNING', [])
-
-    allowed_formats = {'TV', 'TV_SHORT'}
-    planning = [
-        a for a in planning
-        if a.get('format') in allowed_formats and a.get('status') == 'FINISHED'
-    ]
+    planning = planningEntries(all_lists)
 
     if not planning:
         return []
 
-    watched_ids = set()
-    for status in ('COMPLETED', 'CURRENT', 'REPEATING'):
-        for anime in all_lists.get(status, []):
-            watched_ids.add(anime['id'])
+    context = scoringContext(username, all_lists)
+
+    checkpoint = cache.peek('runs', username) or {}
+    resume_ids = set(checkpoint.get('pending', []))
 
     if progress_callback:
-        progress_callback(5, 100, "Fetching relation data...")
+        if resume_ids:
+            progress_callback(5, 100, f"Resuming: {len(resume_ids)} titles left from last run...")
+        else:
+            progress_callback(5, 100, "Fetching relation data...")
+
+    # (planning index, anime) in fetch order; index breaks APL ties like a full run would
+    order = list(enumerate(planning))
+    if top_k:
+        bounds = {i: aplUpperBound(anime, context) for i, anime in order}
+        order.sort(key=lambda item: bounds[item[0]], reverse=True)
+    elif resume_ids:
+        order.sort(key=lambda item: item[1]['id'] not in resume_ids)
+
+    def make_row(i, anime, relations, rel_age, rel_stale, unresolved=False):
+        row = scoreAnime(anime, relations or [], context)
+        row['dataAge'] = max(lists_age, rel_age) if rel_age is not None else None
+        row['stale'] = lists_stale or rel_stale or unresolved
+        row['unresolved'] = unresolved
+        row['_index'] = i
+        return row
 
     results = []
+    deferred = []   # (planning index, anime) whose relations fetch failed
+    failed = {}     # anime ID -> error, checkpointed for the next run
+    top_heap = []   # min-heap of the k best APLs seen so far
     total = len(planning)
 
-    for i, anime in enumerate(planning):
+    for n, (i, anime) in enumerate(order):
+        if top_k and len(top_heap) >= top_k and bounds[i] < top_heap[0]:
+            break
+
         if progress_callback:
-            pct = 5 + int((i / total) * 90)
+            pct = 5 + int((n / total) * 85)
             progress_callback(
                 pct, 100,
-                f"Processing {i+1}/{total}: {anime['title']['romaji'][:30]}"
+                f"Processing {n+1}/{total}: {anime['title']['romaji'][:30]}"
             )
 
-        relations = getRelationsData(anime['id'])
-
-        p_val, relation_info = pFactor(relations, watched_ids)
-        b_val = bFactor(anime.get('episodes'), anime.get('averageScore'))
-        apl_score = aplCalc(anime.get('averageScore', 0), p_val, b_val)
-
-        eps = anime.get('episodes') or 0
-        dur = anime.get('duration') or 24
-        watch_hours = round((eps * dur) / 60, 1) if eps > 0 else 0
-
-        results.append({
-            'title': anime['title']['romaji'],
-            'APL': apl_score,
-            'averageScore': anime.get('averageScore', 0),
-            'episodes': eps,
-            'duration': dur,
-            'watchTime': watch_hours,
-            'pfactor': p_val,
-            'bfactor': b_val,
-            'relation': relation_info,
-            'id': anime['id'],
-            '_relations': relations,
-        })
+        if failures >= MAX_FETCH_FAILURES:
+            # AniList looks down: use the cache, and fetch whatever isn't fresh next run
+            relations, rel_age, rel_stale = loadRelations(anime['id'], CACHE_ONLY, revalidate)
+            if relations is None or (rel_stale and mode == ONLINE):
+                failed[anime['id']] = "skipped, AniList unreachable"
+            row = make_row(i, anime, relations, rel_age, rel_stale,
+                           unresolved=relations is None)
+        else:
+            try:
+                relations, rel_age, rel_stale = loadRelations(anime['id'], mode, revalidate)
+            except FETCH_ERRORS:
+                failures += 1
+                deferred.append((i, anime))
+                continue
+            failures = 0
+            row = make_row(i, anime, relations, rel_age, rel_stale)
+        results.append(row)
+
+        if top_k:
+            if len(top_heap) < top_k:
+                heapq.heappush(top_heap, row['APL'])
+            elif row['APL'] > top_heap[0]:
+                heapq.heapreplace(top_heap, row['APL'])
+
+    # Second chance for failed titles, then fall back to whatever is cached
+    for n, (i, anime) in enumerate(deferred):
+        if progress_callback:
+            progress_callback(
+                90 + int((n / len(deferred)) * 9), 100,
+                f"Retrying {n+1}/{len(deferred)}: {anime['title']['romaji'][:30]}"
+            )
+        if failures < MAX_FETCH_FAILURES:
+            try:
+                relations, rel_age, rel_stale = loadRelations(anime['id'], mode, revalidate)
+                results.append(make_row(i, anime, relations, rel_age, rel_stale))
+                failures = 0
+                continue
+            except FETCH_ERRORS as e:
+                failures += 1
+                failed[anime['id']] = str(e) or type(e).__name__
+        else:
+            failed[anime['id']] = "skipped, AniList unreachable"
+        relations, rel_age, _ = lookupRelations(anime['id'])
+        results.append(make_row(i, anime, relations, rel_age, True,
+                                unresolved=relations is None))
+
+    if failed:
+        cache.set('runs', username, {'pending': list(failed), 'errors': failed})
+    elif checkpoint:
+        cache.delete('runs', username)
+
+    if top_k:
+        results.sort(key=lambda r: (-r['APL'], r['_index']))
+        results = results[:top_k]
+
+    # Top-k runs only score part of the list, so only their list changes are
+    # recorded. Offline runs learned nothing new and aren't recorded at all.
+    if mode != CACHE_ONLY:
+        history.record(username, all_lists, None if top_k else results)
 
     # Group related anime by franchise, order within groups
     results = groupResults(results)
 
-    # Clean up internal field
+    # Clean up internal fields
     for r in results:
         r.pop('_relations', None)
+        r.pop('_index', None)
 
     if progress_callback:
-        progress_callback(100, 100, f"Done! {len(results)} anime processed.")
+        if failures >= MAX_FETCH_FAILURES:
+            progress_callback(100, 100, f"AniList unreachable, {len(failed)} titles left for the next run.")
+        elif failed:
+            progress_callback(100, 100, f"Done with {len(failed)} titles unresolved.")
+        else:
+            progress_callback(100, 100, f"Done! {len(results)} anime processed.")
 
     return results
@@ -0,0 +1,205 @@
+import sys
+import os
+import json
+import threading
+import time
+from collections import deque
+from cache import cache, DEFAULT_TTL
+from search import fetchAllLists, getRelationsData, lookupRelations, CALLS, RATE_LIMIT
+from pFactor import planningEntries
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+USERDATA_PATH = os.path.join(BASE_DIR, 'userdata.json')
+
+REFRESH_AHEAD = 0.8   # refresh once an entry has used 80% of its TTL
+BUDGET_SHARE = 0.25   # share of the API rate budget background refreshes may use
+POLL_INTERVAL = 30    # seconds between scans for entries close to expiry
+BATCH_SIZE = 20       # entries refreshed before the due list is rebuilt
+
+
+class RefreshScheduler:
+    """
+    Keeps cache entries for tracked users warm by refreshing them in the
+    background shortly before they expire, so interactive runs hit a warm cache.
+
+    Background refreshes go through the normal rate-limited API path and are
+    additionally capped at budget_share of CALLS per RATE_LIMIT window, leaving
+    the rest of the budget for foreground requests.
+    """
+
+    def __init__(self, budget_share=BUDGET_SHARE, refresh_ahead=REFRESH_AHEAD,
+                 poll_interval=POLL_INTERVAL, batch_size=BATCH_SIZE):
+        self.budget_share = budget_share
+        self.refresh_ahead = refresh_ahead
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.last_error = None
+        self._usernames = set()
+        self._relation_ids = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._call_times = deque()
+
+    def track_user(self, username):
+        """Keep a user's lists and their planning relations warm."""
+        if not username:
+            return
+        with self._lock:
+            self._usernames.add(username)
+        self._wake.set()
+
+    def untrack_user(self, username):
+        with self._lock:
+            self._usernames.discard(username)
+
+    def track_relations(self, anime_ids):
+        """Keep relation entries for the given anime IDs warm."""
+        with self._lock:
+            self._relation_ids.update(str(i) for i in anime_ids)
+        self._wake.set()
+
+    def revalidate(self, namespace, key):
+        """Queue a background refresh for an entry served stale (getPFactorData revalidate hook)."""
+        if namespace == 'lists':
+            self.track_user(key)
+        elif namespace == 'relations':
+            self.track_relations([key])
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _is_due(self, namespace, key, default_ttl):
+        age = cache.age(namespace, key)
+        if age is None:
+            return True
+        return age >= cache.ttl(namespace, key, default_ttl) * self.refresh_ahead
+
+    def _still_due(self, namespace, key):
+        """Re-check an entry just before fetching it; a foreground run may have refreshed it."""
+        if namespace == 'lists':
+            return self._is_due('lists', key, DEFAULT_TTL)
+        relations, age, ttl = lookupRelations(key)
+        return relations is None or age >= ttl * self.refresh_ahead
+
+    def pending(self):
+        """
+        Returns list of (namespace, key) entries that are missing or close to expiry.
+        User lists come first, then relations ordered oldest first.
+        """
+        with self._lock:
+            usernames = sorted(self._usernames)
+            relation_ids = set(self._relation_ids)
+
+        tasks = [('lists', u) for u in usernames if self._is_due('lists', u, DEFAULT_TTL)]
+
+        # Planning relations of tracked users, taken from whatever list data is on disk
+        for username in usernames:
+            all_lists = cache.peek('lists', username)
+            if all_lists:
+                relation_ids.update(str(a['id']) for a in planningEntries(all_lists))
+
+        due = []
+        for key in relation_ids:
+            # Includes entries served from an attached relation snapshot
+            relations, age, ttl = lookupRelations(key)
+            if relations is None:
+                due.append((float('inf'), key))
+            elif age >= ttl * self.refresh_ahead:
+                due.append((age, key))
+        due.sort(reverse=True)
+        tasks.extend(('relations', key) for _, key in due)
+        return tasks
+
+    def _acquire(self):
+        """Block until the background budget allows another call. Returns False if stopped."""
+        max_calls = max(1, int(CALLS * self.budget_share))
+        while not self._stop.is_set():
+            now = time.monotonic()
+            while self._call_times and now - self._call_times[0] >= RATE_LIMIT:
+                self._call_times.popleft()
+            if len(self._call_times) < max_calls:
+                self._call_times.append(now)
+                return True
+            self._stop.wait(RATE_LIMIT - (now - self._call_times[0]))
+        return False
+
+    def run_once(self):
+        """
+        Refresh every entry currently due. Returns the number of entries refreshed.
+
+        Works in batches of batch_size, rebuilding the due list in between so
+        newly tracked users go first, and skips entries that are fresh again
+        by the time their turn comes. Each entry is tried at most once per call.
+        """
+        refreshed = 0
+        tried = set()
+        while not self._stop.is_set():
+            batch = [task for task in self.pending() if task not in tried][:self.batch_size]
+            if not batch:
+                break
+            for namespace, key in batch:
+                tried.add((namespace, key))
+                if not self._acquire():
+                    return refreshed
+                # Waiting for budget can take a while; don't spend it on an
+                # entry the foreground has refreshed in the meantime
+                if not self._still_due(namespace, key):
+                    self._call_times.pop()
+                    continue
+                try:
+                    if namespace == 'lists':
+                        fetchAllLists(key, refresh=True)
+                    else:
+                        getRelationsData(int(key), refresh=True)
+                    refreshed += 1
+                except Exception as e:
+                    self.last_error = f"{namespace}/{key}: {e}"
+        return refreshed
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+
+def _saved_username():
+    if os.path.exists(USERDATA_PATH):
+        try:
+            with open(USERDATA_PATH, 'r') as f:
+                return json.load(f).get('Anilist', '')
+        except (json.JSONDecodeError, IOError):
+            pass
+    return ''
+
+
+if __name__ == '__main__':
+    # Daemon mode: python scheduler.py [username ...] (defaults to the saved user)
+    usernames = sys.argv[1:] or [u for u in [_saved_username()] if u]
+    if not usernames:
+        print("No usernames given and no saved user found.")
+        sys.exit(1)
+
+    scheduler = RefreshScheduler()
+    for name in usernames:
+        scheduler.track_user(name)
+    print(f"Keeping cache warm for: {', '.join(usernames)}")
+    scheduler.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        scheduler.stop()
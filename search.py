@@ -1,97 +1,97 @@
-import requests
+import asyncio
 import json
+import struct
+import threading
 import time
-from ratelimit import limits, sleep_and_retry
-from cache import cache, DEFAULT_TTL, RELATIONS_TTL
+from collections import deque
+import os
+import aiohttp
+from cache import cache, ttl_policy, DEFAULT_TTL, RELATIONS_TTL, DAY
+from snapshot import RelationSnapshot, SNAPSHOT_PATH
 
 URL = "https://graphql.anilist.co"
 CALLS = 85
 RATE_LIMIT = 60
+MAX_CONCURRENCY = 8
+MAX_RETRIES = 3       # retries for 5xx responses and connection errors
+RETRY_BACKOFF = 2     # seconds before the first retry, doubled per attempt
+MAX_BACKOFF = 30
+MEDIA_BATCH_SIZE = 50 # AniList's per-page maximum
 
+# Errors a request can still raise after its retries are used up
+FETCH_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
 
-@sleep_and_retry
-@limits(calls=CALLS, period=RATE_LIMIT)
-def _api_request(query, variables):
-    """Make a rate-limited request to AniList GraphQL API."""
-    headers = {
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-    }
-    response = requests.post(
-        URL, json={'query': query, 'variables': variables}, headers=headers
-    )
-
-    if response.status_code == 429:
-        retry_after = int(response.headers.get('Retry-After', 5))
-        time.sleep(retry_after)
-        return _api_request(query, variables)
-
-    response.raise_for_status()
-    return response.json()
+# Cache modes for loadLists / loadRelations
+ONLINE = 'online'                    # fetch anything missing or expired
+STALE_OK = 'stale-while-revalidate'  # serve expired entries, fetch only missing ones
+CACHE_ONLY = 'cache-only'            # never touch the network
 
+HEADERS = {
+    'Content-Type': 'application/json',
+    'Accept': 'application/json',
+}
 
-def fetchAllLists(username):
-    """
-    Fetch all anime lists for a user in a single API call.
-    Returns dict of status -> list of media entries.
-    Implements WIP: 'Get data with all lists'
-    """
-    cached = cache.get('lists', username, ttl=DEFAULT_TTL)
-    if cached is not None:
-        return cached
-
-    query = """
-    query($username: String, $type: MediaType) {
-        MediaListCollection(userName: $username, type: $type) {
-            lists {
-                status
-                entries {
-                    media {
-                        title { romaji }
-                        episodes
-                        duration
-                        averageScore
-                        format
-                        status
-                        id
-                    }
+LISTS_QUERY = """
+query($username: String, $type: MediaType) {
+    MediaListCollection(userName: $username, type: $type) {
+        lists {
+            status
+            entries {
+                score(format: POINT_100)
+                media {
+                    title { romaji }
+                    episodes
+                    duration
+                    averageScore
+                    popularity
+                    trending
+                    genres
+                    format
+                    status
+                    id
                 }
             }
         }
     }
-    """
-
-    result = _api_request(query, {"username": username, "type": "ANIME"})
-    lists = result["data"]["MediaListCollection"]["lists"]
-
-    organized = {}
-    for lst in lists:
-        status = lst.get("status")
-        if status is None:
-            continue
-        if status not in organized:
-            organized[status] = []
-        organized[status].extend([entry["media"] for entry in lst["entries"]])
+}
+"""
 
-    cache.set('lists', username, organized)
-    return organized
-
-
-def getRelationsData(anime_id):
-    """
-    Fetch relation data for a single anime.
-    Uses edges (not nodes) to get relation types (SEQUEL, PREQUEL, etc).
-    Implements WIP: 'Add relation data for series order'
-    """
-    cached = cache.get('relations', str(anime_id), ttl=RELATIONS_TTL)
-    if cached is not None:
-        return cached
+RELATIONS_QUERY = """
+query($id: Int) {
+    Media(id: $id, type: ANIME) {
+        id
+        status
+        title { romaji }
+        relations {
+            edges {
+                relationType
+                node {
+                    id
+                    type
+                    format
+                    status
+                    title { romaji }
+                }
+            }
+        }
+    }
+}
+"""
 
-    query = """
-    query($id: Int) {
-        Media(id: $id, type: ANIME) {
+MEDIA_BATCH_QUERY = """
+query($ids: [Int], $perPage: Int) {
+    Page(perPage: $perPage) {
+        media(id_in: $ids, type: ANIME) {
             id
             title { romaji }
+            episodes
+            duration
+            averageScore
+            popularity
+            trending
+            genres
+            format
+            status
             relations {
                 edges {
                     relationType
@@ -106,13 +106,157 @@ def getRelationsData(anime_id):
             }
         }
     }
+}
+"""
+
+
+class RateLimiter:
     """
+    Sliding-window rate limiter shared by every thread and event loop in the process.
+    Callers reserve a slot under a thread lock, then wait for it without holding the lock.
+    """
+
+    def __init__(self, calls, period):
+        self.calls = calls
+        self.period = period
+        self._slots = deque()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Reserve the next call slot. Returns seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            while self._slots and self._slots[0] <= now - self.period:
+                self._slots.popleft()
+            slot = now
+            if len(self._slots) >= self.calls:
+                slot = max(now, self._slots[-self.calls] + self.period)
+            self._slots.append(slot)
+            return slot - now
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+_limiter = RateLimiter(CALLS, RATE_LIMIT)
+
+
+class _Flight:
+    """One in-flight lookup and the event-loop futures waiting on it."""
+
+    def __init__(self):
+        self.waiters = []   # (loop, future)
+
+
+class _LeaderGone(Exception):
+    """Tells waiters the leading fetch was cancelled and they should retry."""
+
+
+def _resolve(future, result, error):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent lookups of the same key into one request.
+
+    The first caller for a key runs the fetch; callers arriving while it is
+    in flight (from any thread or event loop) wait for it and share its
+    result or error. If the leading caller is cancelled instead, the waiters
+    start over, so one caller's timeout doesn't fail everyone else's lookup.
+    The sync API runs each call on its own event loop, so coalescing here
+    covers sync threads and async callers alike.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    async def do(self, key, fetch):
+        """Return await fetch(), or the result of an identical fetch already running."""
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                if flight is not None:
+                    loop = asyncio.get_running_loop()
+                    future = loop.create_future()
+                    flight.waiters.append((loop, future))
+                else:
+                    flight = self._flights[key] = _Flight()
+                    future = None
+
+            if future is None:
+                return await self._lead(key, flight, fetch)
+            try:
+                return await future
+            except _LeaderGone:
+                continue   # take the lead or join the next flight
+
+    async def _lead(self, key, flight, fetch):
+        result, error = None, None
+        try:
+            result = await fetch()
+            return result
+        except Exception as e:
+            error = e
+            raise
+        except BaseException:
+            # Cancellation belongs to this caller only
+            error = _LeaderGone()
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                waiters = flight.waiters
+            for loop, waiter in waiters:
+                loop.call_soon_threadsafe(_resolve, waiter, result, error)
+
+
+_flight = SingleFlight()
+
+
+def _organize_lists(result):
+    """Turn a MediaListCollection response into status -> list of media entries."""
+    organized = {}
+    for lst in result["data"]["MediaListCollection"]["lists"]:
+        status = lst.get("status")
+        if status is None:
+            continue
+        if status not in organized:
+            organized[status] = []
+        for entry in lst["entries"]:
+            media = entry["media"]
+            media["userScore"] = entry.get("score") or 0
+            organized[status].append(media)
+    return organized
+
+
+def _store_lists(username, organized):
+    # List activity is about entries and scores, not popularity/trending drift
+    fingerprint = {
+        status: sorted([m["id"], m["userScore"]] for m in entries)
+        for status, entries in organized.items()
+    }
+    unchanged_for = cache.unchanged_for('lists', username, fingerprint)
+    cache.set('lists', username, organized,
+              ttl=ttl_policy.lists(unchanged_for), fingerprint=fingerprint)
+
+
+def _parse_relations(result):
+    """Returns (media status, anime relations) from a Media relations response."""
+    return _media_relations(result["data"]["Media"])
 
-    result = _api_request(query, {"id": anime_id})
 
-    edges = result["data"]["Media"]["relations"]["edges"]
+def _media_relations(media):
     relations = []
-    for edge in edges:
+    for edge in media["relations"]["edges"]:
         node = edge["node"]
         if node["type"] == "ANIME":
             relations.append({
@@ -122,6 +266,296 @@ def getRelationsData(anime_id):
                 "format": node["format"],
                 "status": node["status"],
             })
+    return media.get("status"), relations
+
+
+def _store_relations(anime_id, media_status, relations):
+    unchanged_for = cache.unchanged_for('relations', str(anime_id), relations)
+    ttl = ttl_policy.relations(media_status, relations, unchanged_for)
+    cache.set('relations', str(anime_id), relations, ttl=ttl)
+
+
+def _store_media(media):
+    """Cache a media record (list-entry shape, without relations) for titles not on any list."""
+    cache.set('media', str(media["id"]), media, ttl=DAY)
+
+
+_snapshot = None
+_snapshot_checked = False
+_snapshot_lock = threading.Lock()
+
+
+def useSnapshot(path=SNAPSHOT_PATH):
+    """
+    Attach a relation snapshot (see snapshot.py) as a read-only fallback
+    behind the disk cache. Pass None to detach. The default snapshot path is
+    attached automatically on first lookup if the file exists.
+    """
+    global _snapshot, _snapshot_checked
+    with _snapshot_lock:
+        if _snapshot is not None:
+            _snapshot.close()
+        _snapshot = RelationSnapshot(path) if path else None
+        _snapshot_checked = True
+
+
+def _get_snapshot():
+    global _snapshot, _snapshot_checked
+    if not _snapshot_checked:
+        with _snapshot_lock:
+            if not _snapshot_checked:
+                if os.path.exists(SNAPSHOT_PATH):
+                    try:
+                        _snapshot = RelationSnapshot(SNAPSHOT_PATH)
+                    except (OSError, ValueError, struct.error):
+                        # A damaged snapshot is ignored, not retried on every lookup
+                        _snapshot = None
+                _snapshot_checked = True
+    return _snapshot
+
+
+def lookupRelations(anime_id):
+    """
+    Relations from the disk cache, falling back to the attached snapshot,
+    regardless of expiry. Returns (relations, age, ttl) or (None, None, None).
+    A cache entry wins over the snapshot unless the snapshot copy is newer.
+    """
+    relations, age, ttl = cache.lookup('relations', str(anime_id), RELATIONS_TTL)
+    snapshot = _get_snapshot()
+    if snapshot is not None:
+        snap_entry = snapshot.get(anime_id)
+        if snap_entry is not None:
+            snap_age = time.time() - snap_entry[1]
+            if relations is None or snap_age < age:
+                return snap_entry[0], snap_age, snap_entry[2]
+    return relations, age, ttl
+
+
+def _fresh_relations(anime_id):
+    relations, age, ttl = lookupRelations(anime_id)
+    if relations is not None and age <= ttl:
+        return relations
+    return None
+
+
+class CacheMiss(LookupError):
+    """Raised in CACHE_ONLY mode when required data is not on disk."""
+
+
+class AniListClient:
+    """
+    Async AniList client for event-loop hosts (bots, web services).
+
+    Requests share the process-wide rate limiter and disk cache with the sync
+    API; max_concurrency bounds how many requests one client has in flight.
+    Use as an async context manager, one client per event loop:
+
+        async with AniListClient() as client:
+            lists = await client.fetchAllLists(username)
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, session=None):
+        self.max_concurrency = max_concurrency
+        self._session = session
+        self._owns_session = session is None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None and self._owns_session:
+            await self._session.close()
+        self._session = None
+
+    async def request(self, query, variables):
+        """
+        Make a rate-limited request to AniList GraphQL API.
+        429s wait for Retry-After; 5xx responses and connection errors are
+        retried up to MAX_RETRIES times with exponential backoff.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._session is None:
+            self._session = aiohttp.ClientSession(headers=HEADERS)
+
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                await _limiter.acquire()
+                try:
+                    async with self._session.post(
+                        URL, json={'query': query, 'variables': variables}
+                    ) as response:
+                        if response.status == 429:
+                            await asyncio.sleep(int(response.headers.get('Retry-After', 5)))
+                            continue
+                        response.raise_for_status()
+                        return await response.json()
+                except FETCH_ERRORS as e:
+                    client_error = (isinstance(e, aiohttp.ClientResponseError)
+                                    and e.status < 500)
+                    if client_error or attempt >= MAX_RETRIES:
+                        raise
+                attempt += 1
+                await asyncio.sleep(min(RETRY_BACKOFF * 2 ** (attempt - 1), MAX_BACKOFF))
+
+    async def fetchAllLists(self, username, refresh=False):
+        """Async variant of fetchAllLists."""
+        if not refresh:
+            cached = cache.get('lists', username, ttl=DEFAULT_TTL)
+            if cached is not None:
+                return cached
+        return await _flight.do(('lists', username),
+                                lambda: self._fetch_lists(username, refresh))
 
-    cache.set('relations', str(anime_id), relations)
-    return relations
+    async def _fetch_lists(self, username, refresh):
+        if not refresh:
+            # A flight that just finished may have stored it before we took the lead
+            cached = cache.get('lists', username, ttl=DEFAULT_TTL)
+            if cached is not None:
+                return cached
+        result = await self.request(LISTS_QUERY, {"username": username, "type": "ANIME"})
+        organized = _organize_lists(result)
+        _store_lists(username, organized)
+        return organized
+
+    async def getRelationsData(self, anime_id, refresh=False):
+        """Async variant of getRelationsData."""
+        if not refresh:
+            cached = _fresh_relations(anime_id)
+            if cached is not None:
+                return cached
+        return await _flight.do(('relations', str(anime_id)),
+                                lambda: self._fetch_relations(anime_id, refresh))
+
+    async def _fetch_relations(self, anime_id, refresh):
+        if not refresh:
+            cached = _fresh_relations(anime_id)
+            if cached is not None:
+                return cached
+        result = await self.request(RELATIONS_QUERY, {"id": anime_id})
+        media_status, relations = _parse_relations(result)
+        _store_relations(anime_id, media_status, relations)
+        return relations
+
+    async def getRelationsBatch(self, anime_ids, refresh=False):
+        """Fetch relations for many anime concurrently. Returns dict of id -> relations."""
+        results = await asyncio.gather(
+            *(self.getRelationsData(anime_id, refresh) for anime_id in anime_ids)
+        )
+        return dict(zip(anime_ids, results))
+
+    async def getMediaBatch(self, anime_ids):
+        """
+        Fetch media details and relations for many anime, MEDIA_BATCH_SIZE
+        per request, with the pages sent concurrently. Both are written to
+        the cache. Returns dict of id -> (media, relations); IDs AniList
+        doesn't know are left out.
+        """
+        anime_ids = list(anime_ids)
+        chunks = [anime_ids[i:i + MEDIA_BATCH_SIZE]
+                  for i in range(0, len(anime_ids), MEDIA_BATCH_SIZE)]
+        pages = await asyncio.gather(*(
+            self.request(MEDIA_BATCH_QUERY, {"ids": chunk, "perPage": MEDIA_BATCH_SIZE})
+            for chunk in chunks
+        ))
+        found = {}
+        for page in pages:
+            for media in page["data"]["Page"]["media"]:
+                media_status, relations = _media_relations(media)
+                del media["relations"]
+                _store_relations(media["id"], media_status, relations)
+                _store_media(media)
+                found[media["id"]] = (media, relations)
+        return found
+
+
+def _run_sync(call):
+    """Run call(client) on a fresh event loop with its own client."""
+    async def main():
+        async with AniListClient() as client:
+            return await call(client)
+    return asyncio.run(main())
+
+
+def fetchAllLists(username, refresh=False):
+    """
+    Fetch all anime lists for a user in a single API call.
+    Returns dict of status -> list of media entries.
+    Pass refresh=True to skip the cache lookup and always refetch.
+    Implements WIP: 'Get data with all lists'
+    """
+    if not refresh:
+        cached = cache.get('lists', username, ttl=DEFAULT_TTL)
+        if cached is not None:
+            return cached
+    return _run_sync(lambda client: client.fetchAllLists(username, refresh))
+
+
+def getRelationsData(anime_id, refresh=False):
+    """
+    Fetch relation data for a single anime.
+    Uses edges (not nodes) to get relation types (SEQUEL, PREQUEL, etc).
+    Pass refresh=True to skip the cache lookup and always refetch.
+    Implements WIP: 'Add relation data for series order'
+    """
+    if not refresh:
+        cached = _fresh_relations(anime_id)
+        if cached is not None:
+            return cached
+    return _run_sync(lambda client: client.getRelationsData(anime_id, refresh))
+
+
+def getMediaBatch(anime_ids):
+    """
+    Fetch media details and relations for many anime in batched requests
+    (see AniListClient.getMediaBatch). Always hits the network.
+    """
+    if not anime_ids:
+        return {}
+    return _run_sync(lambda client: client.getMediaBatch(anime_ids))
+
+
+def _load(namespace, key, lookup, fetch, mode, revalidate):
+    data, age, ttl = lookup()
+    if data is not None and age <= ttl:
+        return data, age, False
+    if mode != ONLINE and (data is not None or mode == CACHE_ONLY):
+        if revalidate:
+            revalidate(namespace, key)
+        return data, age, True
+    return fetch(), 0, False
+
+
+def loadLists(username, mode=ONLINE, revalidate=None):
+    """
+    fetchAllLists with an explicit cache mode.
+    revalidate(namespace, key) is called for every expired or missing entry
+    served without fetching, e.g. to queue a background refresh.
+
+    Returns (lists, age in seconds, stale). Raises CacheMiss in CACHE_ONLY
+    mode if the user's lists have never been cached.
+    """
+    lists, age, stale = _load('lists', username,
+                              lambda: cache.lookup('lists', username, DEFAULT_TTL),
+                              lambda: fetchAllLists(username),
+                              mode, revalidate)
+    if lists is None:
+        raise CacheMiss(f"No cached lists for {username}")
+    return lists, age, stale
+
+
+def loadRelations(anime_id, mode=ONLINE, revalidate=None):
+    """
+    getRelationsData with an explicit cache mode, see loadLists.
+    Returns (relations, age in seconds, stale); relations and age are None
+    in CACHE_ONLY mode if the anime was never cached.
+    """
+    return _load('relations', str(anime_id),
+                 lambda: lookupRelations(anime_id),
+                 lambda: getRelationsData(anime_id),
+                 mode, revalidate)
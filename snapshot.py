@@ -0,0 +1,220 @@
+import sys
+import os
+import json
+import mmap
+import struct
+import shutil
+from bisect import bisect_left
+from operator import add
+from cache import CACHE_DIR, RELATIONS_TTL
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_PATH = os.path.join(BASE_DIR, 'relations.snap')
+
+MAGIC = b'APLREL1\0'
+HEADER = struct.Struct('<8sII')   # magic, entry count, reserved
+
+
+class RelationSnapshot:
+    """
+    Read-only, memory-mapped store of relation data for cold starts.
+
+    File layout (little-endian), columns sorted by anime ID:
+
+        header   magic, count
+        ts       float64[count]   when the relations were fetched
+        ttl      float64[count]   expiry in seconds (0 = RELATIONS_TTL)
+        offset   uint64[count]    start of the entry's JSON in the data blob
+        id       uint32[count]
+        length   uint32[count]
+        data     UTF-8 JSON relation lists
+
+    A lookup is a bisect over the mapped ID column and one JSON decode of the
+    matching slice; nothing else is read or parsed.
+    """
+
+    def __init__(self, path):
+        if sys.byteorder != 'little':
+            raise ValueError("Relation snapshots are only supported on little-endian hosts")
+        self.path = path
+        self._file = None
+        self._mm = None
+        try:
+            self._open()
+        except BaseException:
+            self.close()
+            raise
+
+    def _open(self):
+        self._file = open(self.path, 'rb')
+        # Raises ValueError for an empty file
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self._mm)
+        if size < HEADER.size:
+            raise ValueError(f"{self.path} is too small to be a relation snapshot")
+        magic, self.count, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a relation snapshot")
+
+        n = self.count
+        if HEADER.size + 32 * n > size:
+            raise ValueError(f"{self.path} is truncated")
+        view = memoryview(self._mm)
+        pos = HEADER.size
+        self._ts = view[pos:pos + 8 * n].cast('d')
+        pos += 8 * n
+        self._ttl = view[pos:pos + 8 * n].cast('d')
+        pos += 8 * n
+        self._offsets = view[pos:pos + 8 * n].cast('Q')
+        pos += 8 * n
+        self._ids = view[pos:pos + 4 * n].cast('I')
+        pos += 4 * n
+        self._lengths = view[pos:pos + 4 * n].cast('I')
+        pos += 4 * n
+        self._data_start = pos
+        self._view = view
+        if n and pos + max(map(add, self._offsets, self._lengths)) > size:
+            raise ValueError(f"{self.path} is truncated")
+
+    def __len__(self):
+        return self.count
+
+    def _find(self, anime_id):
+        anime_id = int(anime_id)
+        i = bisect_left(self._ids, anime_id)
+        if i < self.count and self._ids[i] == anime_id:
+            return i
+        return None
+
+    def __contains__(self, anime_id):
+        return self._find(anime_id) is not None
+
+    def get(self, anime_id):
+        """Returns (relations, ts, ttl) for an anime, or None if not in the snapshot."""
+        i = self._find(anime_id)
+        if i is None:
+            return None
+        start = self._data_start + self._offsets[i]
+        raw = self._mm[start:start + self._lengths[i]]
+        try:
+            relations = json.loads(raw.decode('utf-8'))
+        except ValueError:
+            return None   # damaged entry; treat it as missing
+        return relations, self._ts[i], self._ttl[i] or RELATIONS_TTL
+
+    def ids(self):
+        return self._ids.tolist()
+
+    def close(self):
+        for name in ('_ts', '_ttl', '_offsets', '_ids', '_lengths', '_view'):
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def writeSnapshot(path, entries):
+    """
+    Write a snapshot from (anime_id, relations, ts, ttl) tuples.
+    The file is written next to path and renamed into place.
+    """
+    rows = sorted(
+        ((int(anime_id), json.dumps(relations).encode('utf-8'), ts, ttl or 0)
+         for anime_id, relations, ts, ttl in entries),
+        key=lambda r: r[0]
+    )
+
+    offsets = []
+    offset = 0
+    for _, blob, _, _ in rows:
+        offsets.append(offset)
+        offset += len(blob)
+
+    n = len(rows)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, n, 0))
+        f.write(struct.pack(f'<{n}d', *(r[2] for r in rows)))
+        f.write(struct.pack(f'<{n}d', *(r[3] for r in rows)))
+        f.write(struct.pack(f'<{n}Q', *offsets))
+        f.write(struct.pack(f'<{n}I', *(r[0] for r in rows)))
+        f.write(struct.pack(f'<{n}I', *(len(r[1]) for r in rows)))
+        for _, blob, _, _ in rows:
+            f.write(blob)
+    os.replace(tmp_path, path)
+    return n
+
+
+def _cached_relations():
+    """Yields (anime_id, relations, ts, ttl) for every relations entry in the disk cache."""
+    rel_dir = os.path.join(CACHE_DIR, 'relations')
+    if not os.path.isdir(rel_dir):
+        return
+    for name in os.listdir(rel_dir):
+        if not name.endswith('.json') or not name[:-5].isdigit():
+            continue
+        try:
+            with open(os.path.join(rel_dir, name), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            yield int(name[:-5]), entry['data'], entry['ts'], entry.get('ttl', 0)
+        except (json.JSONDecodeError, KeyError, TypeError, IOError):
+            continue
+
+
+def exportCache(path, merge_with=None):
+    """
+    Export the relations in the disk cache to a snapshot file.
+    If merge_with names an existing snapshot, its entries are kept unless the
+    cache has a newer copy.
+    """
+    entries = {}
+    if merge_with and os.path.exists(merge_with):
+        with RelationSnapshot(merge_with) as old:
+            for anime_id in old.ids():
+                relations, ts, ttl = old.get(anime_id)
+                entries[anime_id] = (anime_id, relations, ts, ttl)
+    for entry in _cached_relations():
+        if entry[0] not in entries or entry[2] >= entries[entry[0]][2]:
+            entries[entry[0]] = entry
+    return writeSnapshot(path, entries.values())
+
+
+if __name__ == '__main__':
+    usage = (
+        "Usage:\n"
+        "  python snapshot.py export <file>   write cached relations to a snapshot\n"
+        "  python snapshot.py import <file>   install a snapshot for this instance\n"
+        "  python snapshot.py info [file]     show snapshot contents"
+    )
+    if len(sys.argv) < 2 or sys.argv[1] not in ('export', 'import', 'info'):
+        print(usage)
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == 'export' and len(sys.argv) == 3:
+        count = exportCache(sys.argv[2])
+        print(f"Exported {count} relation entries to {sys.argv[2]}")
+    elif command == 'import' and len(sys.argv) == 3:
+        with RelationSnapshot(sys.argv[2]) as snap:
+            count = len(snap)
+        shutil.copyfile(sys.argv[2], f"{SNAPSHOT_PATH}.tmp")
+        os.replace(f"{SNAPSHOT_PATH}.tmp", SNAPSHOT_PATH)
+        print(f"Installed snapshot with {count} relation entries at {SNAPSHOT_PATH}")
+    elif command == 'info':
+        path = sys.argv[2] if len(sys.argv) > 2 else SNAPSHOT_PATH
+        with RelationSnapshot(path) as snap:
+            print(f"{path}: {len(snap)} relation entries")
+    else:
+        print(usage)
+        sys.exit(1)